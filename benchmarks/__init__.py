@@ -0,0 +1,6 @@
+#
+# Copyright (C) 2020 IBM. All Rights Reserved.
+#
+# See LICENSE file in the root directory
+# of this source tree for licensing information.
+#
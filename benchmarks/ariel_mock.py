@@ -0,0 +1,205 @@
+#
+# Copyright (C) 2020 IBM. All Rights Reserved.
+#
+# See LICENSE file in the root directory
+# of this source tree for licensing information.
+#
+
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from requests.adapters import HTTPAdapter
+
+from pyclient.qradar import AQL
+from .synthetic import event_rows
+
+
+class ArielServer(object):
+    '''
+    A local stand-in for the QRadar Ariel search API: start a search, poll its status and progress,
+    load its results with or without a Range header, and delete it.
+    Every search returns record_count rows shaped like the output of aql, cycled from a pool of pre-rendered rows
+    so the server stays cheap at millions of rows.
+    '''
+
+    def __init__(self, record_count=10000, aql=AQL.proxy_model, queue_seconds=0.0, execute_seconds=0.2,
+                 pool=10000, port=0):
+        '''
+        :param record_count: rows returned by each search, can be changed between searches
+        :param aql: search the rows are shaped like
+        :param queue_seconds: time a search is in WAIT status
+        :param execute_seconds: time a search is in EXECUTE status, with its progress going up to 100
+        :param pool: number of distinct rows
+        :param port: port to listen on, 0 to pick a free one
+        '''
+        self.record_count = record_count
+        self.queue_seconds = queue_seconds
+        self.execute_seconds = execute_seconds
+        self.searches = {}  # search_id -> {'query', 'started', 'record_count'}
+        self.requests = 0
+        self._rows = [json.dumps(row, separators=(',', ':')).encode() for row in event_rows(pool, aql)]
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', port), _handler(self))
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def console(self) -> str:
+        '''
+        :return: host:port of the server, to use as the console of QRadar
+        '''
+        host, port = self._httpd.server_address[:2]
+        return f'{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def status(self, search_id) -> dict:
+        search = self.searches[search_id]
+        elapsed = time.time() - search['started']
+        record = {'search_id': search_id, 'cursor_id': search_id, 'record_count': 0, 'progress': 0,
+                  'status': 'WAIT', 'query_string': search['query']}
+        if elapsed < self.queue_seconds:
+            return record
+        elapsed -= self.queue_seconds
+        if elapsed < self.execute_seconds:
+            record.update(status='EXECUTE', progress=int(100 * elapsed / self.execute_seconds))
+            return record
+        record.update(status='COMPLETED', progress=100, record_count=search['record_count'],
+                      query_execution_time=int(1000 * self.execute_seconds))
+        return record
+
+    def rows(self, start, end):
+        '''
+        :return: generator of the JSON encoded rows start to end, inclusive
+        '''
+        pool = self._rows
+        for i in range(start, end + 1):
+            yield pool[i % len(pool)]
+
+
+def _handler(server: ArielServer):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True  # headers and body are separate writes, which delayed ACKs would stall
+
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, code, obj, headers=None):
+            body = json.dumps(obj).encode()
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _search_id(self):
+            match = re.match(r'^/api/ariel/searches/([\w-]+)(/results)?/?$', self.path.split('?')[0])
+            if not match or match.group(1) not in server.searches:
+                self._send_json(404, {'http_response': {'code': 404, 'message': 'Search not found'}})
+                return None, False
+            return match.group(1), bool(match.group(2))
+
+        def do_POST(self):
+            with server._lock:
+                server.requests += 1
+            if self.path.split('?')[0].rstrip('/') != '/api/ariel/searches':
+                return self._send_json(404, {'http_response': {'code': 404, 'message': 'Not found'}})
+            length = int(self.headers.get('Content-Length', 0))
+            form = parse_qs(self.rfile.read(length).decode())
+            query = (form.get('query_expression') or parse_qs(self.path.partition('?')[2]).get('query_expression')
+                     or [''])[0]
+            search_id = str(uuid.uuid4())
+            server.searches[search_id] = {'query': query, 'started': time.time(),
+                                          'record_count': server.record_count}
+            self._send_json(201, server.status(search_id))
+
+        def do_GET(self):
+            with server._lock:
+                server.requests += 1
+            search_id, results = self._search_id()
+            if search_id is None:
+                return
+            record = server.status(search_id)
+            if not results:
+                return self._send_json(200, record)
+            if record['status'] != 'COMPLETED':
+                return self._send_json(404, {'http_response': {'code': 404, 'message': 'Search is not completed'}})
+
+            count = record['record_count']
+            start, end, code, headers = 0, count - 1, 200, {}
+            match = re.match(r'items=(\d+)-(\d+)', self.headers.get('Range', ''))
+            if match:
+                start, end = int(match.group(1)), min(int(match.group(2)), count - 1)
+                code = 206
+                headers['Content-Range'] = f'items {start}-{end}/{count}'
+
+            # write the rows in batches, without building the whole body in memory
+            rows = list(server.rows(start, end)) if end >= start else []
+            head, tail = b'{"events":[', b']}'
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(head) + sum(map(len, rows)) + max(len(rows) - 1, 0) + len(tail)))
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(head)
+            for i in range(0, len(rows), 1000):
+                self.wfile.write((b',' if i else b'') + b','.join(rows[i:i + 1000]))
+            self.wfile.write(tail)
+
+        def do_DELETE(self):
+            with server._lock:
+                server.requests += 1
+            search_id, _ = self._search_id()
+            if search_id is None:
+                return
+            record = server.status(search_id)
+            del server.searches[search_id]
+            self._send_json(202, record)
+
+    return Handler
+
+
+class PlainHTTPAdapter(HTTPAdapter):
+    '''
+    Sends the https requests of a session as plain http, as QRadar always calls https://console
+    '''
+
+    def send(self, request, **kwargs):
+        if request.url.startswith('https://'):
+            request.url = 'http://' + request.url[len('https://'):]
+        return super().send(request, **kwargs)
+
+
+def plain_http(session):
+    '''
+    Mount PlainHTTPAdapter on a session, keeping its pool size and retries
+
+    :param session: requests.Session, like QRadar.session
+    '''
+    adapter = session.get_adapter('https://')
+    session.mount('https://', PlainHTTPAdapter(pool_connections=adapter._pool_connections,
+                                               pool_maxsize=adapter._pool_maxsize, max_retries=adapter.max_retries))
+    return session
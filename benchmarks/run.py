@@ -0,0 +1,236 @@
+#
+# Copyright (C) 2020 IBM. All Rights Reserved.
+#
+# See LICENSE file in the root directory
+# of this source tree for licensing information.
+#
+'''
+Offline benchmarks of pyclient, against a local Ariel stand-in and synthetic STIX bundles.
+
+    python -m benchmarks.run --rows 10000,100000,1000000 --output baseline.jsonl
+    python -m benchmarks.run --rows 10000,100000,1000000 --baseline baseline.jsonl
+
+Each result is the best of --repeat runs. With --output the results are appended as JSON lines,
+and with --baseline each result is compared to the latest result of the same benchmark in that file.
+'''
+
+import argparse
+import gc
+import importlib
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pyclient.general import SecuredAPI
+from pyclient.qradar import AQL, QRadar
+from .ariel_mock import ArielServer, plain_http
+from .synthetic import stix_bundle
+
+
+def _timed(fn, repeat):
+    # best of repeat runs, and the value returned by the best run
+    best, value = None, None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = fn()
+        seconds = time.perf_counter() - start
+        if best is None or seconds < best:
+            best, value = seconds, result
+    return best, value
+
+
+def _result(benchmark, case, rows, seconds, **extra) -> dict:
+    result = {'benchmark': benchmark, 'case': case, 'rows': rows, 'seconds': seconds,
+              'rows_per_second': rows / seconds if seconds else 0.0}
+    result.update(extra)
+    return result
+
+
+def bench_search_df(server, sizes, repeat):
+    '''
+    QRadar.search_df of AQL.proxy_model shaped rows: paged, with parallel result fetches, and with inferred dtypes
+    '''
+    qradar = QRadar(console=server.console, token='benchmark', cleanup_results=True)
+    plain_http(qradar.session)
+    cases = {'paged': {}, 'fetch_workers=4': {'fetch_workers': 4}, 'dtypes=infer': {'dtypes': 'infer'}}
+    if _installed('ijson'):
+        cases['stream_parse'] = {'stream_parse': True}
+    try:
+        for rows in sizes:
+            server.record_count = rows
+            for case, kwargs in cases.items():
+                def run():
+                    qradar.search_df(AQL.proxy_model, use_cache=False, **kwargs)
+                    return qradar.last_search_stats
+                seconds, stats = _timed(run, repeat)
+                phases = {f'{phase}_seconds': value for phase, value in stats.phases.items()}
+                yield _result('qradar.search_df', case, rows, seconds, bytes=stats.counters.get('bytes', 0), **phases)
+    finally:
+        qradar.close()
+
+
+def bench_secured_api(server, sizes, repeat, requests=2000):
+    '''
+    SecuredAPI.get throughput on a search status record, one request at a time and from 8 threads
+    '''
+    api = SecuredAPI(endpoint=f'http://{server.console}/api', token='benchmark', pool_size=8)
+    search_id = api.post('ariel/searches', params={}).json()['search_id']
+    path = f'ariel/searches/{search_id}'
+    for case, workers in (('sequential', 1), ('threads=8', 8)):
+        def run():
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(lambda _: api.get(path), range(requests)))
+        seconds, _ = _timed(run, repeat)
+        yield _result('SecuredAPI.get', case, requests, seconds, requests_per_second=requests / seconds)
+    api.delete(path)
+    api.close()
+
+
+def bench_flatten(sizes, repeat, flatten_sco_limit=10000):
+    '''
+    StixShifterDataFrame.stix2dataframe of a whole bundle, and flatten_sco of each observed-data object
+    '''
+    from pyclient.stix_shifter_dataframe import StixShifterDataFrame
+    for rows in sizes:
+        bundle = stix_bundle(rows)
+        seconds, _ = _timed(lambda: StixShifterDataFrame().stix2dataframe(bundle), repeat)
+        yield _result('stix2dataframe', 'bundle', rows, seconds)
+
+        # flatten_sco builds a DataFrame per object, so only the first objects are timed
+        objects = [obj for obj in bundle['objects'] if obj['type'] == 'observed-data'][:flatten_sco_limit]
+        flattener = StixShifterDataFrame()
+        seconds, _ = _timed(lambda: [flattener.flatten_sco(obj) for obj in objects], repeat)
+        yield _result('flatten_sco', 'per object', len(objects), seconds)
+
+
+class StandInTranslation(object):
+    '''
+    Stands in for stix_translation.StixTranslation: a pattern translates to queries copies of itself,
+    and the records of a data source, their indexes, translate to synthetic observed-data objects
+    '''
+
+    def __init__(self, queries=1):
+        self.queries = queries
+
+    def translate(self, module, translate_type, data_source, data, options=None):
+        if translate_type == 'query':
+            return {'queries': [data] * self.queries}
+        records = json.loads(data)
+        return stix_bundle(len(records), start=records[0] if records else 0)
+
+
+class StandInTransmission(object):
+    '''
+    Stands in for stix_transmission.StixTransmission of a data source with a number of records
+    '''
+
+    def __init__(self, records, latency=0.0):
+        self.records = records
+        self.latency = latency  # seconds taken by each call, like the round trip to the data source
+
+    def query(self, query):
+        time.sleep(self.latency)
+        return {'success': True, 'search_id': query}
+
+    def is_async(self):
+        return False
+
+    def results(self, search_id, offset, length):
+        time.sleep(self.latency)
+        return {'success': True, 'data': list(range(offset, min(offset + length, self.records)))}
+
+
+def bench_stix_search_df(sizes, repeat, sources=4, latency=0.05):
+    '''
+    StixShifterDataFrame.search_df over several data sources, with stand-ins for the translation and transmissions
+    '''
+    from pyclient.stix_shifter_dataframe import StixShifterDataFrame
+    for rows in sizes:
+        def run():
+            shifter = StixShifterDataFrame()
+            shifter.translation = StandInTranslation()
+            config_names = [f'source{i}' for i in range(sources)]
+            for name in config_names:
+                shifter.add_config(name, {'translation_module': 'qradar', 'transmission_module': 'qradar',
+                                          'data_source': '{}', 'connection': {}, 'configuration': {}})
+                shifter._transmissions[name] = StandInTransmission(rows // sources, latency)
+            shifter.search_df("[ipv4-addr:value = '10.0.0.1']", config_names, raise_errors=True)
+            return shifter.last_search_stats
+        seconds, stats = _timed(run, repeat)
+        phases = {f'{phase}_seconds': value for phase, value in stats.phases.items()}
+        yield _result('stix.search_df', f'sources={sources}', rows, seconds, **phases)
+
+
+def _installed(module) -> bool:
+    try:
+        importlib.import_module(module)
+        return True
+    except ImportError:
+        return False
+
+
+def _compare(result, baseline) -> str:
+    previous = baseline.get((result['benchmark'], result['case'], result['rows']))
+    if not previous:
+        return ''
+    return f"  {result['seconds'] / previous['seconds']:.2f}x baseline"
+
+
+def _load_baseline(path) -> dict:
+    baseline = {}
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                result = json.loads(line)
+                baseline[(result['benchmark'], result['case'], result['rows'])] = result
+    return baseline
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', default='1000,10000,100000', help='comma separated numbers of rows')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each benchmark, the best is reported')
+    parser.add_argument('--only', default='search_df,secured_api,flatten,stix_search_df',
+                        help='comma separated benchmarks to run')
+    parser.add_argument('--execute-seconds', type=float, default=0.2, help='time each mock search takes')
+    parser.add_argument('--output', help='JSON lines file to append the results to')
+    parser.add_argument('--baseline', help='JSON lines file of earlier results to compare to')
+    args = parser.parse_args(argv)
+
+    sizes = [int(rows) for rows in args.rows.split(',')]
+    only = set(args.only.split(','))
+    baseline = _load_baseline(args.baseline) if args.baseline else {}
+    run = {'run_started': time.time(), 'python': sys.version.split()[0]}
+
+    server = ArielServer(execute_seconds=args.execute_seconds).start()
+    benchmarks = []
+    if 'search_df' in only:
+        benchmarks.append(bench_search_df(server, sizes, args.repeat))
+    if 'secured_api' in only:
+        benchmarks.append(bench_secured_api(server, sizes, args.repeat))
+    if {'flatten', 'stix_search_df'} & only:
+        if not _installed('stix_shifter'):
+            print('stix-shifter is not installed, skipping the stix-shifter benchmarks')
+        else:
+            if 'flatten' in only:
+                benchmarks.append(bench_flatten(sizes, args.repeat))
+            if 'stix_search_df' in only:
+                benchmarks.append(bench_stix_search_df(sizes, args.repeat))
+
+    try:
+        for benchmark in benchmarks:
+            for result in benchmark:
+                print(f"{result['benchmark']:<20} {result['case']:<16} {result['rows']:>10} rows "
+                      f"{result['seconds']:>9.3f} s {result['rows_per_second']:>12.0f} rows/s"
+                      + _compare(result, baseline))
+                if args.output:
+                    with open(args.output, 'a') as f:
+                        f.write(json.dumps(dict(run, **result)) + '\n')
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
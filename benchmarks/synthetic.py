@@ -0,0 +1,101 @@
+#
+# Copyright (C) 2020 IBM. All Rights Reserved.
+#
+# See LICENSE file in the root directory
+# of this source tree for licensing information.
+#
+
+import random
+import re
+
+from pyclient.qradar import AQL
+
+
+def aql_columns(aql=AQL.proxy_model) -> dict:
+    '''
+    Columns of the rows a search returns, in select list order
+
+    aql: A string containing the QRadar search in AQL form
+    :return: column name -> 'integer', 'float' or 'category', columns of unknown type are taken as integers
+    :rtype: dict
+    '''
+    schema = AQL.schema(aql)
+    aql = re.sub(r'/\*.*?\*/', ' ', aql, flags=re.DOTALL)
+    aliases = re.findall(r'\s+as\s+(\w+)', aql[:re.search(r'\sfrom\s', aql, flags=re.IGNORECASE).start()],
+                         flags=re.IGNORECASE)
+    return {alias: schema.get(alias, 'integer') for alias in aliases}
+
+
+def event_rows(n, aql=AQL.proxy_model, users=500, seed=0) -> list:
+    '''
+    Synthetic Ariel result rows shaped like the output of a search, like AQL.proxy_model
+
+    n: number of rows
+    users: number of distinct values of the category columns
+    seed: seed of the random values, the same seed gives the same rows
+    :return: list of row dicts
+    :rtype: list
+    '''
+    rand = random.Random(seed)
+    columns = aql_columns(aql)
+    rows = []
+    for i in range(n):
+        row = {}
+        for column, dtype in columns.items():
+            if dtype == 'category':
+                row[column] = f'{column}{rand.randrange(users)}'
+            elif dtype == 'float':
+                row[column] = round(rand.uniform(0, 1000), 4)
+            else:
+                row[column] = rand.randrange(100000)
+        if 'timeslice' in row:
+            row['timeslice'] = 480000 + i // users
+        rows.append(row)
+    return rows
+
+
+def observed_data(i, rand) -> dict:
+    '''
+    A synthetic observed-data object, with the SCO graph of a network event like the QRadar connector returns
+
+    i: index of the object, used in its id and values
+    rand: random.Random to pick the values and which optional SCOs are included
+    '''
+    src, dst = f'10.{i % 256}.{rand.randrange(256)}.{rand.randrange(256)}', f'192.168.{rand.randrange(256)}.1'
+    objects = {
+        '0': {'type': 'ipv4-addr', 'value': src, 'resolves_to_refs': ['2']},
+        '1': {'type': 'ipv4-addr', 'value': dst},
+        '2': {'type': 'mac-addr', 'value': '00:50:56:%02x:%02x:%02x' % (rand.randrange(256), rand.randrange(256), i % 256)},
+        '3': {'type': 'network-traffic', 'src_ref': '0', 'dst_ref': '1', 'src_port': rand.randrange(1024, 65535),
+              'dst_port': rand.choice([53, 80, 443, 8080]), 'protocols': ['tcp', rand.choice(['http', 'ssl'])]},
+        '4': {'type': 'user-account', 'user_id': f'user{rand.randrange(500)}'},
+        '5': {'type': 'x-qradar', 'qid': rand.randrange(10000000), 'magnitude': rand.randrange(10),
+              'log_source_id': rand.randrange(200), 'direction': rand.choice(['L2L', 'L2R', 'R2L', 'R2R'])},
+    }
+    # a few shapes, as connectors leave out the SCOs of fields without a value
+    if rand.random() < 0.3:
+        objects['6'] = {'type': 'url', 'value': f'https://example{rand.randrange(100)}.com/{i}'}
+    if rand.random() < 0.2:
+        objects['7'] = {'type': 'file', 'name': f'file{i}.exe', 'hashes': {'SHA-256': '%064x' % rand.getrandbits(256)}}
+        objects['8'] = {'type': 'process', 'pid': rand.randrange(65535), 'binary_ref': '7', 'creator_user_ref': '4'}
+    return {'type': 'observed-data', 'id': f'observed-data--{i:08d}-0000-4000-8000-000000000000',
+            'created_by_ref': 'identity--3532c56d-ea72-48be-a2ad-1a53f4c9c6d3',
+            'created': '2020-06-01T00:00:00.000Z', 'modified': '2020-06-01T00:00:00.000Z',
+            'first_observed': '2020-06-01T%02d:%02d:00.000Z' % (i // 60 % 24, i % 60),
+            'last_observed': '2020-06-01T%02d:%02d:00.000Z' % (i // 60 % 24, i % 60),
+            'number_observed': rand.randrange(1, 10), 'objects': objects}
+
+
+def stix_bundle(n, start=0, seed=0) -> dict:
+    '''
+    A synthetic STIX bundle, like the results translation of a stix-shifter connector
+
+    n: number of observed-data objects
+    start: index of the first observed-data object
+    seed: seed of the random values, the same seed gives the same bundle
+    '''
+    rand = random.Random(seed + start)
+    identity = {'type': 'identity', 'id': 'identity--3532c56d-ea72-48be-a2ad-1a53f4c9c6d3', 'name': 'QRadar',
+                'identity_class': 'events'}
+    return {'type': 'bundle', 'id': 'bundle--00000000-0000-4000-8000-000000000000',
+            'objects': [identity] + [observed_data(i, rand) for i in range(start, start + n)]}
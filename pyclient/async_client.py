@@ -0,0 +1,350 @@
+#
+# Copyright (C) 2020 IBM. All Rights Reserved.
+#
+# See LICENSE file in the root directory
+# of this source tree for licensing information.
+#
+
+import asyncio
+import time
+import aiohttp
+import pandas as pd
+
+from .frames import FrameBuilder
+from .general import SecuredAPI
+from .qradar import AQL, PollingStrategy, QRadar
+from .retry import RateLimiter, RetryPolicy
+
+
+def _proxy_url(proxy):
+    # proxies are given as "host:port" like for the requests based clients
+    if proxy and '://' not in proxy:
+        return 'http://' + proxy
+    return proxy
+
+
+async def _send(session: aiohttp.ClientSession, method, url, policy: RetryPolicy, limiter: RateLimiter = None,
+                log=None, **kwargs) -> aiohttp.ClientResponse:
+    # the asyncio counterpart of retry.send: the policy decides about retries, only the waiting does not block the loop
+    first = time.time()
+    attempt = 0
+    while True:
+        if limiter is not None:
+            wait = limiter.reserve(url)
+            if wait > 0:
+                await asyncio.sleep(wait)
+        try:
+            async with session.request(method, url, **kwargs) as resp:
+                # read the body so it stays available after the connection is released
+                await resp.read()
+            error = None
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            resp, error = None, e
+        if error is None and resp.status < 400:
+            return resp
+
+        wait = policy.after_failure(method, attempt, first, status=resp.status if resp is not None else None,
+                                    error=error, headers=resp.headers if resp is not None else None, url=url,
+                                    limiter=limiter, log=log)
+        if wait is None:
+            if error is not None:
+                raise error
+            return resp
+        await asyncio.sleep(wait)
+        attempt += 1
+
+
+class AsyncSecuredAPI(object):
+    '''
+    An asyncio API client for APIs with security settings, with the same methods as SecuredAPI
+    '''
+
+    def __init__(self,
+                 endpoint=None,
+                 username=None, password=None,
+                 token=None,
+                 proxy=None,
+                 debug=False,
+                 pool_size=10,
+                 retry_policy=None,
+                 rate_limiter=None):
+        '''
+        Create the AsyncSecuredAPI object to invoke APIs with security settings
+
+        :param endpoint: in the form of (https://)host:port/path
+        :param username: username, if using basic auth
+        :param password: password, if using basic auth
+        :param token: SEC token (authorized service), can be used instead of basic auth
+        :param proxy: proxy if needed. Example: "proxy.us.company.com:8080"
+        :param debug: print logs
+        :param pool_size: number of connections kept alive to the endpoint
+        :param retry_policy: RetryPolicy deciding which failed requests are sent again and when
+        :param rate_limiter: RateLimiter pacing the requests to the endpoint, can be shared with other clients
+        '''
+
+        self.endpoint = endpoint
+        self.proxy = _proxy_url(proxy)
+        self.debug = debug
+        self.pool_size = pool_size
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.url = None  # latest URL used
+        self.session = None  # created on first request, inside the running event loop
+        # api_key is encoded from username and password
+        self.headers, self.api_key = SecuredAPI._credential_headers(username, password, token)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _log(self, message):
+        if self.debug:
+            print(message)
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, ssl=False)
+            self.session = aiohttp.ClientSession(headers=self.headers, connector=connector)
+        return self.session
+
+    def _get_url(self, service_path) -> str:
+        if service_path:
+            self.url = '/'.join(s.strip('/') for s in [self.endpoint, service_path])
+        assert self.url, 'must provide service_path, or have recently provided a valid service_path'
+        return self.url
+
+    async def _request(self, method='GET', service_path: str=None, params: dict={}, retry=None,
+                       retry_wait=None) -> aiohttp.ClientResponse:
+        # retry and retry_wait override the retries and backoff of the retry policy for this request
+        url = self._get_url(service_path)
+        if method not in ('GET', 'POST', 'DELETE'):
+            raise Exception('Unknown method: %s' % method)
+        self._log('aiohttp.%s: %s' % (method, url))
+        kwargs = {'json': params} if method == 'POST' else {'params': params}
+        policy = self.retry_policy.copy(retries=retry, backoff=retry_wait)
+        resp = await _send(self._get_session(), method, url, policy, self.rate_limiter, log=self._log,
+                           proxy=self.proxy, **kwargs)
+        if resp.status >= 400:
+            self._log('status_code: %s' % resp.status)
+            print(await resp.text())
+            raise Exception("Could not %s: %s" % (method, url))
+        return resp
+
+    async def get(self, service_path: str=None, params: dict={}, retry=None,
+                  retry_wait=None) -> aiohttp.ClientResponse:
+        return await self._request('GET', service_path, params, retry, retry_wait)
+
+    async def post(self, service_path: str=None, params: dict={}, retry=None,
+                   retry_wait=None) -> aiohttp.ClientResponse:
+        return await self._request('POST', service_path, params, retry, retry_wait)
+
+    async def delete(self, service_path: str=None, params: dict={}, retry=None,
+                     retry_wait=None) -> aiohttp.ClientResponse:
+        return await self._request('DELETE', service_path, params, retry, retry_wait)
+
+    def get_endpoint(self, product: str) -> str:
+        return self._get_url(product)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+
+class AsyncQRadar(object):
+    '''
+    The AsyncQRadar() class searches QRadar like QRadar(), on an asyncio event loop.
+    Many searches can be started, polled and loaded at the same time, see gather_searches().
+    '''
+
+    def __init__(self,
+                 console=None,
+                 username=None, password=None,
+                 token=None,
+                 proxy=None,
+                 timeout=10,
+                 debug=False,
+                 cleanup_results=True,
+                 chunk_size=50000,
+                 pool_size=10,
+                 polling=None,
+                 retry_policy=None,
+                 rate_limiter=None):
+        '''
+        Create the AsyncQRadar object to run searches with settings
+
+        :param console: IP or hostname of console, for example "1.2.3.4" or "qradar.company.com"
+        :param username: QRadar username, if using basic auth
+        :param password: QRadar password, if using basic auth
+        :param token: SEC token (authorized service), can be used instead of basic auth
+        :param proxy: proxy if needed. Example: "proxy.us.company.com:8080"
+        :param timeout: Timeout to cancel search in minutes
+        :param debug: Print logs
+        :param cleanup_results: Delete search cursor on QRadar after loading results
+        :param chunk_size: Number of result rows to load per request
+        :param pool_size: Number of connections kept alive to the console
+        :param polling: PollingStrategy deciding the wait between search status checks
+        :param retry_policy: RetryPolicy deciding which failed requests to the console are sent again and when
+        :param rate_limiter: RateLimiter pacing the requests to the console, shared by the concurrent searches
+        '''
+
+        self.console = console
+        self.proxy = _proxy_url(proxy)
+        self.timeout = timeout  # timeout for searches in minutes
+        self.debug = debug
+        self.cleanup_results = cleanup_results
+        self.chunk_size = chunk_size
+        self.pool_size = pool_size
+        self.polling = polling or PollingStrategy()
+        self.retry_policy = retry_policy or RetryPolicy(retries=10, max_backoff=30.0)
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.session = None  # created on first request, inside the running event loop
+        self.headers = QRadar._credential_headers(username, password, token)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _log(self, message):
+        if self.debug:
+            print(message)
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, ssl=False)
+            self.session = aiohttp.ClientSession(headers=self.headers, connector=connector)
+        return self.session
+
+    async def search(self, aql, start_time=None, end_time=None, limit=None, priority=None, chunk_size=None) -> list:
+        '''
+        Search QRadar and return the results as a list, see QRadar.search()
+
+        :return: search results, list of dicts where dict is each row key/values
+        :rtype: list
+        '''
+        results = []
+        async for page in self.search_iter(aql, start_time=start_time, end_time=end_time, limit=limit,
+                                           priority=priority, chunk_size=chunk_size, batches=True):
+            results.extend(page)
+        return results
+
+    async def search_iter(self, aql, start_time=None, end_time=None, limit=None, priority=None, chunk_size=None,
+                          batches=False):
+        '''
+        Search QRadar and yield the results page by page, see QRadar.search_iter()
+
+        :return: async generator of row dicts, or of lists of row dicts if batches is set
+        '''
+        query = QRadar._build_query(aql, start_time=start_time, end_time=end_time, limit=limit, priority=priority)
+        search_id, record = await self._run_search(query)
+        chunk_size = chunk_size or self.chunk_size
+        record_count = record.get('record_count', 0)
+        try:
+            for start in range(0, record_count, chunk_size):
+                page = await self._get_results(search_id, start=start, end=min(start + chunk_size, record_count) - 1)
+                if batches:
+                    yield page
+                else:
+                    for row in page:
+                        yield row
+        finally:
+            if self.cleanup_results:
+                await self._delete(search_id)
+
+    async def search_df(self, aql, start_time=None, end_time=None, limit=None, priority=None,
+                        chunk_size=None, dtypes=None, columns=None, groupby=None, agg=None) -> pd.DataFrame:
+        '''
+        Search QRadar and return the results as a DataFrame, see QRadar.search_df()
+
+        :return: DataFrame of results
+        :rtype: pandas.DataFrame
+        '''
+        if columns or groupby or agg:
+            aql = AQL.push_down(aql, columns=columns, groupby=groupby, agg=agg)
+        builder = FrameBuilder(AQL.schema(aql) if dtypes == 'infer' else dtypes)
+        async for page in self.search_iter(aql, start_time=start_time, end_time=end_time, limit=limit,
+                                           priority=priority, chunk_size=chunk_size, batches=True):
+            builder.add_rows(page)
+        df = builder.build()
+        if columns and not df.empty:
+            df = df[[column for column in columns if column in df]]
+        return df
+
+    async def gather_searches(self, searches, concurrency=10, as_df=True) -> list:
+        '''
+        Run many searches at the same time, at most concurrency of them at once
+
+        searches: list of AQL strings, or of dicts with the keyword arguments of search_df()
+        concurrency: maximum number of searches running on QRadar at a time
+        as_df: return DataFrames, otherwise lists of row dicts
+        :return: results of each search, in the order of searches
+        :rtype: list
+        '''
+        semaphore = asyncio.Semaphore(concurrency)
+        run = self.search_df if as_df else self.search
+
+        async def run_one(search):
+            kwargs = {'aql': search} if isinstance(search, str) else search
+            async with semaphore:
+                return await run(**kwargs)
+
+        return await asyncio.gather(*[run_one(search) for search in searches])
+
+    async def _run_search(self, query) -> tuple:
+        self._log(f'Search query: {query}')
+        search_id = await self._start_search(query)
+        self._log(f'Search ID: {search_id}')
+
+        # Check search status until done
+        search_start = time.time()
+        timeout = search_start + self.timeout * 60
+        polls = 0
+        while time.time() < timeout:
+            record = await self._get_search(search_id)
+            wait = QRadar._poll_wait(self.polling, record, time.time() - search_start, polls, self._log)
+            if wait is None:
+                break
+            polls += 1
+            await asyncio.sleep(max(min(wait, timeout - time.time()), 0))
+        else:
+            await self._delete(search_id)
+            raise Exception(f'Search did not finish within {self.timeout} minutes')
+        return search_id, record
+
+    async def _call(self, method, url, **kwargs) -> aiohttp.ClientResponse:
+        # see QRadar._call
+        return await _send(self._get_session(), method, url, self.retry_policy, self.rate_limiter, log=self._log,
+                           proxy=self.proxy, **kwargs)
+
+    async def _start_search(self, query) -> str:
+        url = QRadar._search_url(self.console)
+        resp = await self._call('POST', url, data={'query_expression': query})
+        if resp.status != 201:
+            self._log(await resp.text())
+            raise Exception('Cannot start search')
+        return (await resp.json(content_type=None)).get('search_id')
+
+    async def _get_search(self, search_id) -> dict:
+        resp = await self._call('GET', QRadar._search_url(self.console, search_id))
+        resp_json = await resp.json(content_type=None)
+        self._log(f"Search {resp_json.get('status')} and {resp_json.get('progress')}% complete")
+        return resp_json
+
+    async def _get_results(self, search_id, start=None, end=None) -> list:
+        url = QRadar._search_url(self.console, search_id, results=True)
+        resp = await self._call('GET', url, headers=QRadar._results_headers(start, end))
+        if resp.status not in QRadar._RESULTS_STATUSES:
+            self._log(await resp.text())
+            raise Exception("Could not load search results")
+        return QRadar._unwrap_results(await resp.json(content_type=None))
+
+    async def _delete(self, search_id):
+        await self._call('DELETE', QRadar._search_url(self.console, search_id))
+        self._log(f'Deleted search cursor {search_id}')
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
@@ -0,0 +1,127 @@
+#
+# Copyright (C) 2020 IBM. All Rights Reserved.
+#
+# See LICENSE file in the root directory
+# of this source tree for licensing information.
+#
+
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+
+import pandas as pd
+
+
+class ResultCache(object):
+    '''
+    An on-disk cache of search results, stored as one Parquet file per query.
+    Entries expire after a ttl and the least recently used ones are evicted once the cache is over max_bytes.
+    '''
+
+    def __init__(self, path='~/.cache/ibm-security-notebooks', ttl=None, max_bytes=2 * 1024 ** 3, debug=False):
+        '''
+        Create the ResultCache object in a directory
+
+        :param path: directory to store the results in, created if missing
+        :param ttl: optional, seconds a result stays valid. Without a ttl results never expire
+        :param max_bytes: size of the directory above which least recently used results are evicted
+        :param debug: print logs
+        '''
+        self.path = os.path.expanduser(path)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.debug = debug
+        os.makedirs(self.path, exist_ok=True)
+
+    def _log(self, message):
+        if self.debug:
+            print(message)
+
+    @staticmethod
+    def normalize(query) -> str:
+        # queries differing only in whitespace or line breaks share an entry, whitespace in quotes is kept
+        parts = re.split(r'(\'[^\']*\'|"[^"]*")', query)
+        return ''.join(part if i % 2 else re.sub(r'\s+', ' ', part) for i, part in enumerate(parts)).strip()
+
+    def _get_file(self, query, dtypes=None) -> str:
+        key = self.normalize(query)
+        if dtypes:
+            # the same search converted to another dtype schema is another entry
+            key += '\n' + json.dumps(dtypes, sort_keys=True, default=str)
+        key = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self.path, key + '.parquet')
+
+    def get(self, query, dtypes=None):
+        '''
+        :param query: final query string of the search
+        :param dtypes: optional, dtype schema the results were built with
+        :return: cached results, or None if missing or expired
+        :rtype: pandas.DataFrame
+        '''
+        file = self._get_file(query, dtypes)
+        try:
+            created = os.stat(file).st_mtime
+        except FileNotFoundError:
+            return None
+        if self.ttl is not None and time.time() - created > self.ttl:
+            self._log(f'Cache expired: {file}')
+            self._remove(file)
+            return None
+        df = pd.read_parquet(file)
+        # access time tracks use for LRU eviction, modification time stays the creation time
+        os.utime(file, (time.time(), created))
+        self._log(f'Cache hit: {file}')
+        return df
+
+    def put(self, query, df: pd.DataFrame, dtypes=None):
+        '''
+        :param query: final query string of the search
+        :param df: results of the search
+        :param dtypes: optional, dtype schema the results were built with
+        :return: the results were stored, a cache which cannot be written to is only logged
+        :rtype: bool
+        '''
+        file = self._get_file(query, dtypes)
+        tmp = f'{file}.{os.getpid()}.tmp'
+        try:
+            df.to_parquet(tmp, index=False)
+            os.replace(tmp, file)
+        except Exception as e:
+            # like a full disk, or columns Parquet cannot store
+            logging.warning(f'Cache not stored: {file}: {e}')
+            self._remove(tmp)
+            return False
+        self._log(f'Cache stored: {file}')
+        self._evict()
+        return True
+
+    def invalidate(self, query=None, dtypes=None):
+        '''
+        :param query: optional, final query string to remove from the cache. Clears the whole cache if not given
+        :param dtypes: optional, dtype schema of the entry to remove
+        '''
+        if query is not None:
+            self._remove(self._get_file(query, dtypes))
+            return
+        for entry in os.scandir(self.path):
+            if entry.name.endswith('.parquet'):
+                self._remove(entry.path)
+
+    def _remove(self, file):
+        try:
+            os.remove(file)
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        entries = [(entry.stat(), entry.path) for entry in os.scandir(self.path) if entry.name.endswith('.parquet')]
+        total = sum(st.st_size for st, _ in entries)
+        for st, file in sorted(entries, key=lambda e: e[0].st_atime):
+            if total <= self.max_bytes:
+                break
+            self._log(f'Cache evicted: {file}')
+            self._remove(file)
+            total -= st.st_size
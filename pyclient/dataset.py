@@ -0,0 +1,103 @@
+#
+# Copyright (C) 2020 IBM. All Rights Reserved.
+#
+# See LICENSE file in the root directory
+# of this source tree for licensing information.
+#
+
+import os
+import shutil
+import threading
+import uuid
+from urllib.parse import quote
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+from pyarrow.fs import LocalFileSystem
+
+
+def time_slice(t) -> str:
+    # partition value of the time slice starting at datetime t
+    return t.strftime('%Y%m%dT%H%M%S') if t else 'all'
+
+
+def _unify(schemas):
+    try:
+        return pa.unify_schemas(schemas, promote_options='permissive')
+    except TypeError:  # pyarrow < 14
+        return pa.unify_schemas(schemas)
+
+
+def open_dataset(path, format='parquet') -> ds.Dataset:
+    '''
+    Open a dataset written by DatasetWriter, nothing is read until it is scanned
+
+    :param path: directory of the dataset
+    :param format: 'parquet', or 'arrow' for Arrow IPC files which are memory-mapped
+    :return: the dataset, with the partition columns data_source and time_slice
+    :rtype: pyarrow.dataset.Dataset
+    '''
+    filesystem = LocalFileSystem(use_mmap=True)
+    dataset = ds.dataset(path, format=format, partitioning='hive', filesystem=filesystem)
+    schemas = [fragment.physical_schema for fragment in dataset.get_fragments()]
+    if not schemas:
+        return dataset
+    # batches may have different columns, or a column null in one batch and typed in another
+    schema = _unify(schemas + [dataset.schema])
+    return ds.dataset(path, format=format, partitioning='hive', filesystem=filesystem, schema=schema)
+
+
+class DatasetWriter(object):
+    '''
+    Writes DataFrame batches as files of a dataset partitioned like path/data_source=x/time_slice=y/,
+    so results larger than memory can be kept on disk and scanned later by column and partition.
+    '''
+
+    partition_cols = ['data_source', 'time_slice']
+
+    def __init__(self, path, format='parquet'):
+        '''
+        :param path: directory of the dataset, created if missing
+        :param format: 'parquet', or 'arrow' for Arrow IPC files which can be memory-mapped
+        '''
+        if format not in ('parquet', 'arrow'):
+            raise Exception(f'Unknown dataset format: {format}')
+        self.path = path
+        self.format = format
+        self.rows = 0
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, df: pd.DataFrame):
+        '''
+        :param df: batch of rows, with data_source and time_slice columns for the partition of each row
+        '''
+        if df.empty:
+            return
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        ds.write_dataset(table, self.path, format='ipc' if self.format == 'arrow' else 'parquet',
+                         partitioning=self.partition_cols, partitioning_flavor='hive',
+                         basename_template=f'part-{uuid.uuid4().hex}-{{i}}.{self.format}',
+                         existing_data_behavior='overwrite_or_ignore')
+        with self._lock:
+            self.rows += len(df)
+
+    def remove(self, data_source, time_slice=None):
+        '''
+        Remove a partition, before it is written again
+
+        :param data_source: data_source of the partition
+        :param time_slice: optional, time_slice of the partition, all time slices of data_source if not given
+        '''
+        partition = os.path.join(self.path, f'data_source={quote(str(data_source), safe="")}')
+        if time_slice is not None:
+            partition = os.path.join(partition, f'time_slice={quote(str(time_slice), safe="")}')
+        shutil.rmtree(partition, ignore_errors=True)
+
+    def dataset(self) -> ds.Dataset:
+        '''
+        :return: the dataset written so far
+        :rtype: pyarrow.dataset.Dataset
+        '''
+        return open_dataset(self.path, format=self.format)
@@ -0,0 +1,159 @@
+#
+# Copyright (C) 2020 IBM. All Rights Reserved.
+#
+# See LICENSE file in the root directory
+# of this source tree for licensing information.
+#
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+
+class FrameBuilder(object):
+    '''
+    Builds a DataFrame from result rows page by page, without keeping the list of row dicts.
+    Each page becomes a DataFrame of numpy columns as it is added, converted with a dtype schema of column name ->
+    dtype, where dtype is 'integer' (numbers, downcast to the smallest int type when lossless once all pages are in),
+    'float', 'category', 'string' or any dtype pandas accepts. Columns missing from the schema are inferred by pandas.
+    '''
+
+    def __init__(self, dtypes: dict=None):
+        '''
+        :param dtypes: optional, dtype schema of the columns
+        '''
+        self.dtypes = dtypes or {}
+        self.frames = []
+        self.pending = []  # rows of add_row() not made into a page yet
+        self.rows = 0
+
+    def add_rows(self, rows: list):
+        '''
+        :param rows: list of dicts where dict is each row key/values
+        '''
+        if not rows:
+            return
+        self._flush()
+        self._add_page(rows)
+
+    def add_row(self, row: dict):
+        '''
+        :param row: dict of the row key/values
+        '''
+        self.pending.append(row)
+        self.rows += 1
+
+    def _flush(self):
+        if self.pending:
+            rows, self.pending = self.pending, []
+            self.rows -= len(rows)
+            self._add_page(rows)
+
+    def _add_page(self, rows):
+        df = pd.DataFrame(rows)
+        for name, dtype in self.dtypes.items():
+            if name in df:
+                df[name] = self._convert(df[name], dtype)
+        self.frames.append(df)
+        self.rows += len(rows)
+
+    def build(self) -> pd.DataFrame:
+        '''
+        :return: DataFrame of the rows added so far
+        :rtype: pandas.DataFrame
+        '''
+        self._flush()
+        df = concat(self.frames)
+        for name, dtype in self.dtypes.items():
+            if dtype == 'integer' and name in df:
+                df[name] = self._convert(df[name], 'integer', downcast=True)
+        return df
+
+    @staticmethod
+    def _convert(values, dtype, downcast=False):
+        try:
+            if dtype == 'integer':
+                return pd.to_numeric(values, downcast='integer' if downcast else None)
+            if dtype == 'float':
+                return pd.to_numeric(values).astype('float64')
+            if dtype == 'category':
+                return values.astype('category')
+            return values.astype(dtype)
+        except (ValueError, TypeError):
+            # values do not match the schema, let pandas infer the column
+            return values
+
+
+def concat(dfs: list) -> pd.DataFrame:
+    '''
+    Concatenate DataFrames in order, keeping category columns whose categories differ between the frames
+
+    :param dfs: list of DataFrames, empty ones are skipped
+    :return: one DataFrame with a new index
+    :rtype: pandas.DataFrame
+    '''
+    dfs = [df for df in dfs if not df.empty]
+    if not dfs:
+        return pd.DataFrame()
+    if len(dfs) == 1:
+        return dfs[0].reset_index(drop=True)
+    dfs = [df.copy(deep=False) for df in dfs]
+    for name, dtype in dfs[0].dtypes.items():
+        if isinstance(dtype, pd.CategoricalDtype) and all(
+                name in df and isinstance(df[name].dtype, pd.CategoricalDtype) for df in dfs):
+            categories = union_categoricals([df[name] for df in dfs]).categories
+            for df in dfs:
+                df[name] = df[name].cat.set_categories(categories)
+    return pd.concat(dfs, ignore_index=True)
+
+
+AGG_FUNCTIONS = ('count', 'sum', 'mean', 'min', 'max', 'std', 'nunique', 'first', 'last')
+
+
+def named_aggs(agg: dict) -> dict:
+    '''
+    Normalize an aggregation spec to output column -> (column, function)
+
+    :param agg: output column -> (column, function), or column -> function or list of functions
+                for output columns named column_function. Column '*' with count counts the rows
+    :return: output column -> (column, function)
+    :rtype: dict
+    '''
+    named = {}
+    for key, value in (agg or {}).items():
+        if isinstance(value, tuple):
+            named[key] = value
+        else:
+            for function in [value] if isinstance(value, str) else value:
+                named[function if key == '*' else f'{key}_{function}'] = (key, function)
+    for column, function in named.values():
+        if function not in AGG_FUNCTIONS:
+            raise Exception(f'Unknown aggregate function: {function}, expected one of {", ".join(AGG_FUNCTIONS)}')
+        if column == '*' and function != 'count':
+            raise Exception('Only count can aggregate the rows, column *')
+    return named
+
+
+def aggregate(df: pd.DataFrame, groupby: list=None, agg: dict=None) -> pd.DataFrame:
+    '''
+    Group and aggregate a DataFrame, with the groupby and agg specs of AQL.push_down()
+
+    :param df: DataFrame to aggregate
+    :param groupby: columns to group by
+    :param agg: aggregates of each group, see named_aggs()
+    :return: DataFrame with a row per group, the groupby columns followed by the aggregates
+    :rtype: pandas.DataFrame
+    '''
+    named = named_aggs(agg)
+    groupby = list(groupby or [])
+    if df.empty:
+        return pd.DataFrame(columns=groupby + list(named))
+    if not groupby:
+        # a single group of all the rows
+        df = df.assign(_all=0)
+        return aggregate(df, ['_all'], agg).drop(columns='_all')
+    grouped = df.groupby(groupby, observed=True, dropna=False, sort=False)
+    columns = {}
+    for name, (column, function) in named.items():
+        columns[name] = grouped.size() if column == '*' else grouped[column].agg(function)
+    result = pd.DataFrame(columns) if columns else grouped.size().to_frame()[[]]
+    return result.reset_index()
@@ -5,11 +5,129 @@
 # of this source tree for licensing information.
 #
 
-import time
+import json
 import requests
+import pandas as pd
 from os import path
 from base64 import b64encode
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urljoin
 from requests import Response
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .retry import RateLimiter, RetryPolicy, send
+from .stats import Stats
+
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+
+def new_session(headers: dict=None, pool_size=10, max_retries=3) -> requests.Session:
+    '''
+    Create a requests.Session that keeps connections alive and reuses them across calls
+
+    :param headers: headers to send with every request of the session
+    :param pool_size: number of connections to keep alive per host
+    :param max_retries: int or urllib3 Retry, retry policy of the mounted adapter.
+                        An int only retries failed connections, never requests that reached the server,
+                        those are left to the RetryPolicy of the client
+    :return: the session
+    :rtype: requests.Session
+    '''
+    if isinstance(max_retries, int):
+        # urllib3 would otherwise also retry a 429 or 503 with Retry-After, on top of the RetryPolicy
+        max_retries = Retry(total=max_retries, read=False, respect_retry_after_header=False)
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=max_retries)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    if headers:
+        session.headers.update(headers)
+    return session
+
+
+class Pagination(object):
+    '''
+    Follows the pages of a listing endpoint, with one of:
+    an offset parameter (offset_param, with the page size in limit_param),
+    a Range header (items=start-end, answered with a Content-Range like QRadar),
+    or else the rel="next" Link header of each response.
+    Stops at a page with fewer than page_size items, or after max_pages.
+    '''
+
+    def __init__(self, items_key=None, page_size=100, offset_param=None, limit_param=None, range_header=False,
+                 max_pages=None):
+        '''
+        :param items_key: key of the list of items in a JSON object response, by default its first list
+        :param page_size: items requested per page
+        :param offset_param: query parameter of the index of the first item of a page, like 'offset' or 'start'
+        :param limit_param: query parameter of the number of items of a page, like 'limit' or 'pageSize'
+        :param range_header: request the pages with a Range header
+        :param max_pages: most pages to load per request, None for all of them
+        '''
+        self.items_key = items_key
+        self.page_size = page_size
+        self.offset_param = offset_param
+        self.limit_param = limit_param
+        self.range_header = range_header
+        self.max_pages = max_pages
+
+    def items(self, data) -> list:
+        '''
+        :param data: decoded JSON of a page
+        :return: the items of the page
+        :rtype: list
+        '''
+        if isinstance(data, list):
+            return data
+        if not isinstance(data, dict):
+            return []
+        if self.items_key:
+            return data.get(self.items_key) or []
+        return next((value for value in data.values() if isinstance(value, list)), [])
+
+    def first(self, url, params) -> tuple:
+        '''
+        :return: url, params and headers of the first page
+        :rtype: tuple
+        '''
+        return self._page(url, params, 0)
+
+    def next(self, resp, url, params, offset, page) -> tuple:
+        '''
+        :param resp: response of the latest page
+        :param offset: number of items loaded so far
+        :param page: items of the latest page
+        :return: url, params and headers of the next page, or None after the last page
+        '''
+        if self.offset_param or self.range_header:
+            if len(page) < self.page_size:
+                return None
+            if self.range_header and '/' in resp.headers.get('Content-Range', ''):
+                total = resp.headers['Content-Range'].rsplit('/', 1)[1]
+                if total.isdigit() and offset >= int(total):
+                    return None
+            return self._page(url, params, offset)
+        link = resp.links.get('next', {}).get('url')
+        if not link or not page:
+            return None
+        # the next link carries the query parameters of the page
+        return urljoin(resp.url, link), {}, {}
+
+    def _page(self, url, params, offset) -> tuple:
+        params, headers = dict(params or {}), {}
+        if self.offset_param:
+            params[self.offset_param] = offset
+        if self.limit_param:
+            params[self.limit_param] = self.page_size
+        if self.range_header:
+            headers['Range'] = f'items={offset}-{offset + self.page_size - 1}'
+        return url, params, headers
 
 
 class SecuredAPI(object):
@@ -22,7 +140,12 @@ class SecuredAPI(object):
                  username=None, password=None,
                  token=None,
                  proxy=None,
-                 debug=False):
+                 debug=False,
+                 pool_size=10,
+                 max_retries=3,
+                 hooks=None,
+                 retry_policy=None,
+                 rate_limiter=None):
         '''
         Create the SecuredAPI object to invoke APIs with security settings
 
@@ -32,67 +155,217 @@ class SecuredAPI(object):
         :param token: SEC token (authorized service), can be used instead of basic auth
         :param proxy: proxy if needed. Example: "proxy.us.company.com:8080"
         :param debug: print logs
+        :param pool_size: number of connections kept alive to the endpoint
+        :param max_retries: int or urllib3 Retry, retry policy for connections to the endpoint
+        :param hooks: callables taking the Stats of each request when it finishes, like a JsonLinesSink
+        :param retry_policy: RetryPolicy deciding which failed requests are sent again and when
+        :param rate_limiter: RateLimiter pacing the requests to the endpoint, can be shared with other clients
         '''
 
         self.endpoint = endpoint
         self.proxy = {'https': proxy} if proxy else None
         self.debug = debug
         self.url = None  # latest URL used
-        self.api_key = None  # encoded from username and password
+        self.hooks = list(hooks or [])
+        self.last_request_stats = None  # Stats of the latest request
+        self.last_batch_stats = None  # Stats of the latest batch() or map_get()
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.rate_limiter = rate_limiter or RateLimiter()
+
+        # api_key is encoded from username and password
+        self.headers, self.api_key = self._credential_headers(username, password, token)
+
+        # Connections are pooled and the headers are sent by the session with every request
+        self.session = new_session(self.headers, pool_size=pool_size, max_retries=max_retries)
+        self.headers = self.session.headers
 
-        # Headers
-        self.headers = {'Accept': 'application/json'}
+    @staticmethod
+    def _credential_headers(username=None, password=None, token=None) -> tuple:
+        # headers sent with every request, shared with AsyncSecuredAPI, and the api_key of basic auth
+        headers, api_key = {'Accept': 'application/json'}, None
         if username and password:
             credentials = '%s:%s' % (username, password)
-            self.api_key = b64encode(credentials.encode()).decode()
-            self.headers['authorization'] = 'Basic ' + self.api_key
+            api_key = b64encode(credentials.encode()).decode()
+            headers['authorization'] = 'Basic ' + api_key
         elif token:
-            self.headers['authorization'] = token
+            headers['authorization'] = token
         else:
             raise Exception("No credentials supplied")
+        return headers, api_key
 
     def _log(self, message):
         if self.debug:
             print(message)
 
-    def _get_headers(self) -> dict:
-        return self.headers.copy()
-
     def _get_url(self, service_path) -> str:
         if service_path:
             self.url = '/'.join(s.strip('/') for s in [self.endpoint, service_path])
         assert self.url, 'must provide service_path, or have recently provided a valid service_path'
         return self.url
 
-    def _request(self, method='GET', service_path: str=None, params: dict={}, retry=0, retry_wait=2) -> Response:
-        self._get_url(service_path)
-        self._log('requests.%s: %s' % (method, self.url))
-        if method == 'GET':
-            resp = requests.get(self.url, params=params, headers=self._get_headers(), verify=False, proxies=self.proxy)
+    def _request(self, method='GET', service_path: str=None, params: dict={}, retry=None, retry_wait=None) -> Response:
+        # retry and retry_wait override the retries and backoff of the retry policy for this request
+        url = self._get_url(service_path)
+        stats = Stats('request', method=method, url=url)
+        try:
+            return self._send(method, url, params, retry, retry_wait, stats)
+        finally:
+            self.last_request_stats = stats
+            stats.finish(self.hooks)
+
+    def _send(self, method, url, params, retry, retry_wait, stats, headers=None) -> Response:
+        self._log('requests.%s: %s' % (method, url))
+        if method in ('GET', 'DELETE'):
+            kwargs = {'params': params}
         elif method == 'POST':
-            resp = requests.post(self.url, json=params, headers=self._get_headers(), verify=False, proxies=self.proxy)
-        elif method == 'DELETE':
-            resp = requests.delete(self.url, params=params, headers=self._get_headers(), verify=False, proxies=self.proxy)
+            kwargs = {'json': params}
         else:
             raise Exception('Unknown method: %s' % method)
+        policy = self.retry_policy.copy(retries=retry, backoff=retry_wait)
+        with stats.timer('request'):
+            resp = send(self.session, method, url, policy, self.rate_limiter, stats=stats, log=self._log,
+                        verify=False, proxies=self.proxy, headers=headers, **kwargs)
+        stats.count('bytes', len(resp.content))
+        stats.labels['status_code'] = resp.status_code
         if resp.status_code >= 400:
             self._log('status_code: %s' % resp.status_code)
-            if retry:
-                time.sleep(retry_wait)
-                return self._request(method, self.url, params, retry=retry - 1, retry_wait=retry_wait)
-            else:
-                print(resp.content)
-                raise Exception("Could not %s: %s" % (method, self.url))
+            print(resp.content)
+            raise Exception("Could not %s: %s" % (method, url))
         return resp
 
-    def get(self, service_path: str=None, params: dict={}, retry=0, retry_wait=2) -> Response:
+    def _call(self, method, url, params, pagination, retry, retry_wait):
+        # one call of a batch: the decoded JSON of the response, or the items of all its pages
+        stats = Stats('request', method=method, url=url)
+        try:
+            if pagination is None:
+                resp = self._send(method, url, params, retry, retry_wait, stats)
+                return _json_loads(resp.content) if resp.content else None
+            items, pages = [], 0
+            page_request = pagination.first(url, params)
+            while page_request is not None:
+                page_url, page_params, headers = page_request
+                resp = self._send(method, page_url, page_params, retry, retry_wait, stats, headers)
+                page = pagination.items(_json_loads(resp.content) if resp.content else None)
+                items.extend(page)
+                pages += 1
+                if pagination.max_pages and pages >= pagination.max_pages:
+                    break
+                page_request = pagination.next(resp, page_url, page_params, len(items), page)
+            stats.count('pages', pages)
+            stats.count('rows', len(items))
+            return items
+        finally:
+            stats.finish(self.hooks)
+
+    def batch(self, calls, concurrency=8, ordered=True, pagination: Pagination=None, raise_errors=True,
+              retry=None, retry_wait=None):
+        '''
+        Send many requests at once over the pooled connections, and decode their JSON responses
+
+        :param calls: service paths, params dicts (for the latest service path),
+                      or tuples of (service_path, params) or (method, service_path, params)
+        :param concurrency: most requests in flight at a time, pool_size connections are kept alive
+        :param ordered: yield the results in the order of calls, otherwise as they complete
+        :param pagination: optional Pagination, to follow the pages of each call and return all their items
+        :param raise_errors: raise the error of a failed call, otherwise yield the exception as its result
+        :param retry: override the retries of the retry policy
+        :param retry_wait: override the backoff of the retry policy
+        :return: generator of the decoded JSON of each call, or of the items of its pages with pagination.
+                 When not ordered, of (index of the call, result) tuples
+        '''
+        stats = Stats('batch', endpoint=self.endpoint, concurrency=concurrency)
+
+        def requests_of(calls):
+            # the urls are resolved in order, so params without a service path use the one before them
+            for call in calls:
+                if isinstance(call, dict):
+                    method, service_path, params = 'GET', None, call
+                elif isinstance(call, (tuple, list)):
+                    method, service_path, params = ('GET',) + tuple(call) if len(call) == 2 else call
+                else:
+                    method, service_path, params = 'GET', call, {}
+                yield method.upper(), self._get_url(service_path), params or {}
+
+        def call(request):
+            try:
+                return self._call(*request, pagination, retry, retry_wait)
+            except Exception as e:
+                stats.count('errors')
+                if raise_errors:
+                    raise
+                return e
+
+        # a window of requests is kept in flight, so results stream without submitting every call upfront
+        window = max(1, concurrency) * 2
+        requests_iter = enumerate(requests_of(calls))
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+                if ordered:
+                    pending = deque()
+                    for index, request in requests_iter:
+                        pending.append(executor.submit(call, request))
+                        stats.count('calls')
+                        if len(pending) >= window:
+                            yield pending.popleft().result()
+                    while pending:
+                        yield pending.popleft().result()
+                else:
+                    pending = {}
+                    for index, request in requests_iter:
+                        pending[executor.submit(call, request)] = index
+                        stats.count('calls')
+                        if len(pending) >= window:
+                            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                            for future in done:
+                                yield pending.pop(future), future.result()
+                    while pending:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            yield pending.pop(future), future.result()
+        finally:
+            self.last_batch_stats = stats
+            stats.finish(self.hooks)
+
+    def map_get(self, paths_or_params, concurrency=8, ordered=True, pagination: Pagination=None,
+                raise_errors=True, retry=None, retry_wait=None):
+        '''
+        GET many service paths, or params of the latest service path, at once, see batch()
+
+        :return: generator of the decoded JSON of each response, or of the items of its pages with pagination
+        '''
+        return self.batch(paths_or_params, concurrency=concurrency, ordered=ordered, pagination=pagination,
+                          raise_errors=raise_errors, retry=retry, retry_wait=retry_wait)
+
+    def map_get_df(self, paths_or_params, concurrency=8, pagination: Pagination=None, retry=None,
+                   retry_wait=None) -> pd.DataFrame:
+        '''
+        GET many service paths, or params of the latest service path, at once, and return all the records
+        in one DataFrame. Each response is a record, a list of records, or a page of them with pagination.
+
+        :return: DataFrame of the records, nested fields are flattened into columns like a.b
+        :rtype: pandas.DataFrame
+        '''
+        records = []
+        for result in self.map_get(paths_or_params, concurrency=concurrency, pagination=pagination,
+                                   retry=retry, retry_wait=retry_wait):
+            if isinstance(result, list):
+                records.extend(result)
+            elif result is not None:
+                records.append(result)
+        # one pass over all the records, instead of a DataFrame per response
+        return pd.json_normalize(records)
+
+    def get(self, service_path: str=None, params: dict={}, retry=None, retry_wait=None) -> Response:
         return self._request('GET', service_path, params, retry, retry_wait)
 
-    def post(self, service_path: str=None, params: dict={}, retry=0, retry_wait=2) -> Response:
+    def post(self, service_path: str=None, params: dict={}, retry=None, retry_wait=None) -> Response:
         return self._request('POST', service_path, params, retry, retry_wait)
 
-    def delete(self, service_path: str=None, params: dict={}, retry=0, retry_wait=2) -> Response:
+    def delete(self, service_path: str=None, params: dict={}, retry=None, retry_wait=None) -> Response:
         return self._request('DELETE', service_path, params, retry, retry_wait)
 
     def get_endpoint(self, product: str) -> str:
         return self._get_url(product)
+
+    def close(self):
+        self.session.close()
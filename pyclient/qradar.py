@@ -5,16 +5,58 @@
 # of this source tree for licensing information.
 #
 
+import re
 import time
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 
 import pandas as pd
-import requests
 import urllib3
 
+from .dataset import DatasetWriter, time_slice
+from .frames import FrameBuilder, concat, named_aggs
+from .general import _json_loads, new_session
+from .retry import RateLimiter, RetryPolicy, send
+from .stats import Stats
+
+try:
+    import ijson
+except ImportError:  # only needed to parse results while they download, see stream_parse
+    ijson = None
+
 urllib3.disable_warnings()
 
 
+def _iter_json_rows(chunks):
+    '''
+    Parse the rows of an Ariel results blob while its bytes arrive, the blob is a dict with a single list
+    like {flows: []} or {events: []} or {cursor: []}
+
+    :param chunks: iterable of bytes of the response body
+    :return: generator of lists of row dicts, one list per chunk parsed
+    '''
+    head = b''
+    rows = coro = None
+    for chunk in chunks:
+        if coro is None:
+            # the key of the list is needed for the prefix of the rows
+            head += chunk
+            match = re.match(rb'\s*\{\s*"((?:[^"\\]|\\.)*)"', head)
+            if not match:
+                continue
+            rows = ijson.sendable_list()
+            coro = ijson.items_coro(rows, match.group(1).decode() + '.item', use_float=True)
+            chunk = head
+        coro.send(chunk)
+        if rows:
+            yield list(rows)
+            del rows[:]
+    if coro is not None:
+        coro.close()
+        if rows:
+            yield list(rows)
+
+
 class AQL:
     proxy_model = """select if username is not null then username else if ASSETUSER(sourceip) is not null then str(ASSETUSER(sourceip)) else str(sourceip) as user,
 endtime/3600000 as timeslice,
@@ -74,6 +116,188 @@ group by user, timeslice
 having general_count_rows > 1 and general_events_R2R != general_sum_eventcount
 order by general_sum_eventcount desc"""
 
+    # event and flow fields holding numbers or strings, for bare fields in a select list
+    integer_fields = {'eventcount', 'starttime', 'endtime', 'devicetime', 'qid', 'sourceport', 'destinationport',
+                      'logsourceid', 'magnitude', 'severity', 'credibility', 'relevance', 'category', 'protocolid',
+                      'highlevelcategory', 'domainid', 'bytessent', 'bytesreceived'}
+    category_fields = {'username', 'user', 'sourceip', 'destinationip', 'sourcemac', 'destinationmac', 'eventdirection',
+                       'sourcegeographiclocation', 'destinationgeographiclocation', 'url', 'hostname'}
+
+    @staticmethod
+    def schema(aql) -> dict:
+        '''
+        Infer a dtype schema for FrameBuilder from the select list of a search
+
+        aql: A string containing the QRadar search in AQL form
+        :return: column name -> dtype for the columns with a known type
+        :rtype: dict
+        '''
+        expressions, _ = AQL._select_list(aql)
+        schema = {}
+        for expression in expressions or []:
+            name, expression = AQL._alias(expression)
+            if name is None:
+                continue
+            expression = expression.lower()
+            if expression in AQL.integer_fields or re.match(r'^(count|uniquecount|sum|min|max|long)\s*\(', expression):
+                schema[name] = 'integer'
+            elif re.match(r'^(avg|stdev)\s*\(', expression):
+                schema[name] = 'float'
+            elif expression in AQL.category_fields or expression.startswith('str(') or (
+                    expression.startswith('if ') and 'str(' in expression):
+                schema[name] = 'category'
+        return schema
+
+    @staticmethod
+    def _top_level(aql, start=0):
+        # positions of the characters of aql outside quotes and parentheses
+        depth, quote = 0, None
+        for i in range(start, len(aql)):
+            c = aql[i]
+            if quote:
+                quote = None if c == quote else quote
+            elif c in '\'"':
+                quote = c
+            elif c == '(':
+                depth += 1
+            elif c == ')':
+                depth -= 1
+            elif depth == 0:
+                yield i
+
+    @staticmethod
+    def _find_clause(aql, pattern, start=0) -> int:
+        # position of the first match of pattern outside quotes and parentheses, -1 if there is none
+        pattern = re.compile(pattern, flags=re.IGNORECASE)
+        return next((i for i in AQL._top_level(aql, start) if pattern.match(aql, i)), -1)
+
+    @staticmethod
+    def _select_list(aql) -> tuple:
+        # expressions of the select list, and the rest of the search from the top level from, without comments
+        aql = re.sub(r'/\*.*?\*/', ' ', aql, flags=re.DOTALL)
+        match = re.match(r'\s*select\s+', aql, flags=re.IGNORECASE)
+        if not match:
+            return None, aql
+
+        # split the select list on top level commas, up to the top level from
+        end = AQL._find_clause(aql, r'\sfrom\s', match.end())
+        end = len(aql) if end < 0 else end
+        expressions, begin = [], match.end()
+        for i in AQL._top_level(aql[:end], match.end()):
+            if aql[i] == ',':
+                expressions.append(aql[begin:i])
+                begin = i + 1
+        expressions.append(aql[begin:end])
+        return [' '.join(expression.split()) for expression in expressions], aql[end:]
+
+    @staticmethod
+    def _alias(expression) -> tuple:
+        # name of the column of a select expression and the expression without its alias, no name if unnamed
+        alias = re.search(r'\s+as\s+(\w+|"[^"]+"|\'[^\']+\')$', expression, flags=re.IGNORECASE)
+        if alias:
+            return alias.group(1).strip('"\''), expression[:alias.start()]
+        if re.match(r'^\w+$', expression):
+            return expression, expression
+        return None, expression
+
+    # AQL functions of the aggregates of push_down(), by their pandas names
+    aggregates = {'count': 'COUNT', 'sum': 'SUM', 'mean': 'AVG', 'min': 'MIN', 'max': 'MAX', 'std': 'STDEV',
+                  'nunique': 'UNIQUECOUNT', 'first': 'FIRST', 'last': 'LAST'}
+
+    @staticmethod
+    def push_down(aql, columns=None, groupby=None, agg=None) -> str:
+        '''
+        Compile a column projection, or a group by with aggregates, into the select list of a search,
+        so QRadar only returns the answer instead of the raw rows
+
+        aql: A string containing the QRadar search in AQL form
+        columns: columns to select, aliases from the select list of aql or AQL expressions
+        groupby: columns to group by, like columns
+        agg: aggregates of each group, output column -> (column, function), or column -> function or list of
+             functions for output columns named column_function. Functions are count, sum, mean, min, max, std,
+             nunique, first and last, and column '*' with count counts the rows
+        :return: the search with the new select list and group by. A projection also selects the columns
+                 the having, order by or group by of aql refer to
+        :rtype: str
+        '''
+        expressions, rest = AQL._select_list(aql)
+        if expressions is None:
+            raise Exception('Columns and aggregates can only be pushed down into a select search')
+        if columns and (groupby or agg):
+            raise Exception('columns selects columns, it cannot be combined with groupby and agg')
+        named = {}
+        for expression in expressions:
+            name, expression = AQL._alias(expression)
+            if name is not None:
+                named[name.lower()] = (name, expression)
+
+        def expression_of(column):
+            name, expression = named.get(column.lower(), (column, column))
+            return expression
+
+        def select(column):
+            expression = expression_of(column)
+            return expression if expression == column else f'{expression} as {column}'
+
+        if columns:
+            select_list = [select(column) for column in columns]
+            # columns the rest of the search refers to, like in its having or order by, are selected too
+            wanted = {column.lower() for column in columns}
+            select_list += [select(name) for key, (name, _) in named.items() if key not in wanted
+                            and re.search(r'\b' + re.escape(name) + r'\b', rest, flags=re.IGNORECASE)]
+        else:
+            select_list = [select(column) for column in groupby or []]
+            for name, (column, function) in named_aggs(agg).items():
+                argument = '*' if column == '*' else expression_of(column)
+                select_list.append(f'{AQL.aggregates[function]}({argument}) as {name}')
+            if groupby and AQL._find_clause(rest, r'\sgroup\s+by\s') >= 0:
+                raise Exception('The search is already grouped, groupby cannot be pushed down into it')
+            # the group by goes before having, order by, limit and the time clause
+            at = AQL._find_clause(rest + ' ', r'\s(group\s+by|having|order\s+by|limit|last|start|stop|parameters)\s')
+            at = len(rest) if at < 0 else at
+            # from there on the search can only refer to the groups and aggregates
+            selected = {column.lower() for column in groupby or []} | {name.lower() for name in named_aggs(agg)}
+            dropped = [name for key, (name, _) in named.items() if key not in selected
+                       and re.search(r'\b' + re.escape(name) + r'\b', rest[at:], flags=re.IGNORECASE)]
+            if dropped:
+                raise Exception(f'The group by, having or order by of the search refers to {", ".join(dropped)}, '
+                                f'which groupby and agg do not select')
+            if groupby:
+                rest = rest[:at] + '\ngroup by ' + ', '.join(groupby) + rest[at:]
+        return 'select ' + ',\n'.join(select_list) + rest
+
+
+class PollingStrategy(object):
+    '''
+    Decides how long to wait between status checks of a running search.
+    Waits start short and grow exponentially up to a cap; once Ariel reports progress,
+    the next check is scheduled for the estimated finish of the search instead.
+    '''
+
+    def __init__(self, initial=0.1, factor=2.0, max_interval=30.0):
+        '''
+        :param initial: seconds to wait after the first status check
+        :param factor: growth of the wait after every status check
+        :param max_interval: longest wait between two status checks, in seconds
+        '''
+        self.initial = initial
+        self.factor = factor
+        self.max_interval = max_interval
+
+    def next_interval(self, elapsed, progress, polls) -> float:
+        '''
+        :param elapsed: seconds since the search was started
+        :param progress: percentage of the search complete, as reported by Ariel
+        :param polls: number of status checks done so far
+        :return: seconds to wait before the next status check
+        :rtype: float
+        '''
+        interval = self.initial * self.factor ** polls
+        if progress and 0 < progress < 100:
+            # linear estimate of the time left, from the time it took to get this far
+            interval = max(self.initial, elapsed * (100 - progress) / progress)
+        return min(interval, self.max_interval)
+
 
 class QRadar(object):
     '''
@@ -88,7 +312,15 @@ class QRadar(object):
                  proxy=None,
                  timeout=10,
                  debug=False,
-                 cleanup_results=True):
+                 cleanup_results=True,
+                 chunk_size=50000,
+                 pool_size=10,
+                 max_retries=3,
+                 polling=None,
+                 cache=None,
+                 hooks=None,
+                 retry_policy=None,
+                 rate_limiter=None):
         '''
         Create the QRadar object to run searches with settings
         Can be used to run multiple searches and return a list of results or DF
@@ -101,6 +333,14 @@ class QRadar(object):
         :param timeout: Timeout to cancel search in minutes
         :param debug: Print logs
         :param cleanup_results: Delete search cursor on QRadar after loading results
+        :param chunk_size: Number of result rows to load per request
+        :param pool_size: Number of connections kept alive to the console, should be at least fetch_workers
+        :param max_retries: int or urllib3 Retry, retry policy for connections to the console
+        :param polling: PollingStrategy deciding the wait between search status checks
+        :param cache: optional ResultCache to keep search_df results on disk
+        :param hooks: callables taking the Stats of each search when it finishes, like a JsonLinesSink
+        :param retry_policy: RetryPolicy deciding which failed requests to the console are sent again and when
+        :param rate_limiter: RateLimiter pacing the requests to the console, shared by the fetch workers and slices
         '''
 
         self.console = console
@@ -108,25 +348,30 @@ class QRadar(object):
         self.timeout = timeout  # timeout for searches in minutes
         self.debug = debug
         self.cleanup_results = cleanup_results
+        self.chunk_size = chunk_size
+        self.polling = polling or PollingStrategy()
+        self.cache = cache
+        self.hooks = list(hooks or [])
+        self.last_slice_stats = []
+        self.last_search_stats = None  # Stats of the latest search: phase timings, bytes, polls, retries, rows
+        self.retry_policy = retry_policy or RetryPolicy(retries=10, max_backoff=30.0)
+        self.rate_limiter = rate_limiter or RateLimiter()
 
-        # Headers
-        self.headers = {'Accept': 'application/json'}
-        if username and password:
-            self.headers['username'] = username
-            self.headers['password'] = password
-        elif token:
-            self.headers['SEC'] = token
-        else:
-            raise Exception("No credentials supplied")
+        # Connections are pooled and the headers are sent by the session with every request
+        self.headers = self._credential_headers(username, password, token)
+        self.session = new_session(self.headers, pool_size=pool_size, max_retries=max_retries)
+        self.headers = self.session.headers
 
     def _log(self, message):
         if self.debug:
             print(message)
 
-    def _get_headers(self) -> dict:
-        return self.headers.copy()
+    def _finish_stats(self, stats):
+        self.last_search_stats = stats
+        stats.finish(self.hooks)
+        self._log(f'Search stats: {stats}')
 
-    def search(self, aql, start_time=None, end_time=None, limit=None, priority=None) -> list:
+    def search(self, aql, start_time=None, end_time=None, limit=None, priority=None, chunk_size=None) -> list:
         '''
         Search QRadar synchronously and return the results as a list
         Can take a long time to run if the search has a large time-frame
@@ -136,10 +381,289 @@ class QRadar(object):
         end_time: optional,  datetime() object for search start time.  Can also be part of search string
         limit: optional, limit search to this many result rows.  Can also be part of search string
         priority: optional, priority to run search as: LOW/NORMAL/HIGH.  Can also be part of search string
+        chunk_size: optional, number of rows to request per page, defaults to QRadar.chunk_size
         :return: search results, list of dicts where dict is each row key/values
         :rtype: list
         '''
+        return list(self.search_iter(aql, start_time=start_time, end_time=end_time, limit=limit, priority=priority,
+                                     chunk_size=chunk_size))
+
+    def search_iter(self, aql, start_time=None, end_time=None, limit=None, priority=None, chunk_size=None,
+                    batches=False, stream_parse=False):
+        '''
+        Search QRadar and yield the results page by page, using Range headers to load them
+        Only one page of results is held in memory at a time
+
+        aql: A string containing the QRadar search in AQL form
+        start_time: optional, datetime() object for search start time.  Can also be part of search string
+        end_time: optional,  datetime() object for search start time.  Can also be part of search string
+        limit: optional, limit search to this many result rows.  Can also be part of search string
+        priority: optional, priority to run search as: LOW/NORMAL/HIGH.  Can also be part of search string
+        chunk_size: optional, number of rows to request per page, defaults to QRadar.chunk_size
+        batches: optional, yield lists of rows as they are parsed instead of yielding single rows
+        stream_parse: optional, parse the rows of each page while it downloads, needs ijson. Slower than parsing
+                      whole pages, only worth it for large chunk_size
+        :return: generator of row dicts, or of lists of row dicts if batches is set
+        '''
+        query = self._build_query(aql, start_time=start_time, end_time=end_time, limit=limit, priority=priority)
+        stats = Stats('search', console=self.console, query=query)
+        try:
+            for page in self._search_pages(query, chunk_size or self.chunk_size, stats, stream_parse):
+                if batches:
+                    yield page
+                else:
+                    yield from page
+        finally:
+            self._finish_stats(stats)
+
+    def search_df(self, aql, start_time=None, end_time=None, limit=None, priority=None, chunk_size=None,
+                  fetch_workers=None, slice_by=None, max_concurrent=4, slice_retries=1, use_cache=True,
+                  dtypes=None, columns=None, groupby=None, agg=None, stream_parse=False) -> pd.DataFrame:
+        '''
+        aql: A string containing the QRadar search in AQL form
+        start_time: optional, datetime() object for search start time.  Can also be part of search string
+        end_time: optional,  datetime() object for search start time.  Can also be part of search string
+        limit: optional, limit search to this many result rows.  Can also be part of search string
+        priority: optional, priority to run search as: LOW/NORMAL/HIGH.  Can also be part of search string
+        chunk_size: optional, number of rows to request per page, defaults to QRadar.chunk_size
+        fetch_workers: optional, load the pages of results on this many connections in parallel
+        slice_by: optional, timedelta() to split start_time/end_time into, each slice runs as its own search.
+                  Rows are returned per slice, so aggregates are not combined across slices
+        max_concurrent: optional, with slice_by, maximum number of slice searches running at a time
+        slice_retries: optional, with slice_by, number of times to rerun a slice that failed
+        use_cache: optional, set to False to bypass QRadar.cache for this search
+        dtypes: optional, dtype schema for the columns (see FrameBuilder), or 'infer' to use AQL.schema(aql)
+        columns: optional, list of the columns to return, selected by QRadar (see AQL.push_down)
+        groupby: optional, list of columns to group the rows by on QRadar, with agg
+        agg: optional, aggregates of each group computed by QRadar, like {'eventcount': 'sum', '*': 'count'}.
+             With slice_by each slice is aggregated on its own
+        stream_parse: optional, parse the rows of each page while it downloads, see search_iter
+        :return: DataFrame of results
+        :rtype: pandas.DataFrame
+        '''
+        stats = Stats('search', console=self.console, query=aql)
+        if columns or groupby or agg:
+            aql = AQL.push_down(aql, columns=columns, groupby=groupby, agg=agg)
+        try:
+            df = self._search_df(aql, start_time=start_time, end_time=end_time, limit=limit, priority=priority,
+                                   chunk_size=chunk_size, fetch_workers=fetch_workers, slice_by=slice_by,
+                                   max_concurrent=max_concurrent, slice_retries=slice_retries, use_cache=use_cache,
+                                   dtypes=dtypes, stream_parse=stream_parse, stats=stats)
+        finally:
+            self._finish_stats(stats)
+        if columns and not df.empty:
+            # leave out the columns only selected for the having or order by of the search
+            df = df[[column for column in columns if column in df]]
+        return df
+
+    def _search_df(self, aql, start_time=None, end_time=None, limit=None, priority=None, chunk_size=None,
+                   fetch_workers=None, slice_by=None, max_concurrent=4, slice_retries=1, use_cache=True,
+                   dtypes=None, stream_parse=False, stats=None) -> pd.DataFrame:
+        if slice_by:
+            if not start_time:
+                raise Exception('start_time is required to slice a search')
+            return self._search_df_sliced(aql, start_time, end_time or datetime.now(), slice_by, max_concurrent,
+                                          slice_retries, limit=limit, priority=priority, chunk_size=chunk_size,
+                                          fetch_workers=fetch_workers, use_cache=use_cache, dtypes=dtypes,
+                                          stream_parse=stream_parse, stats=stats)
+
+        query = self._build_query(aql, start_time=start_time, end_time=end_time, limit=limit, priority=priority)
+        dtypes = AQL.schema(aql) if dtypes == 'infer' else dtypes
+        # only searches over a fixed window in the past have results that cannot change, others need a cache ttl
+        cacheable = self.cache is not None and use_cache and (
+            self.cache.ttl is not None or (start_time and end_time and end_time <= datetime.now(end_time.tzinfo)))
+        if cacheable:
+            with stats.timer('cache'):
+                df = self.cache.get(query, dtypes)
+            if df is not None:
+                self._log('Search results loaded from cache')
+                stats.count('cache_hits')
+                stats.count('rows', len(df))
+                return df
+
+        # each page becomes a DataFrame converted to the schema as it arrives, the pages are joined once
+        builder = FrameBuilder(dtypes)
+        chunk_size = chunk_size or self.chunk_size
+        if fetch_workers and fetch_workers > 1:
+            search_id, record = self._run_search(query, stats)
+            try:
+                for page in self._get_results_parallel(search_id, record.get('record_count', 0), chunk_size,
+                                                       fetch_workers, stats):
+                    with stats.timer('build'):
+                        builder.add_rows(page)
+            finally:
+                if self.cleanup_results:
+                    self._delete(search_id)
+        else:
+            for page in self._search_pages(query, chunk_size, stats, stream_parse):
+                with stats.timer('build'):
+                    builder.add_rows(page)
+        with stats.timer('build'):
+            df = builder.build()
+
+        if cacheable:
+            with stats.timer('cache'):
+                self.cache.put(query, df, dtypes)
+        return df
+
+    def search_to_dataset(self, path, aql, start_time=None, end_time=None, limit=None, priority=None,
+                          chunk_size=None, slice_by=None, max_concurrent=4, slice_retries=1, dtypes=None,
+                          format='parquet', stream_parse=False):
+        '''
+        Search QRadar and write the results to a dataset on disk while they stream in, instead of into memory.
+        The dataset is partitioned by data_source (the console) and time_slice (start of each slice)
+
+        path: directory to write the dataset to, partitions written again are replaced
+        aql: A string containing the QRadar search in AQL form
+        start_time: optional, datetime() object for search start time.  Can also be part of search string
+        end_time: optional,  datetime() object for search start time.  Can also be part of search string
+        limit: optional, limit search to this many result rows.  Can also be part of search string
+        priority: optional, priority to run search as: LOW/NORMAL/HIGH.  Can also be part of search string
+        chunk_size: optional, number of rows to request per page and write per file, defaults to QRadar.chunk_size
+        slice_by: optional, timedelta() to split start_time/end_time into, each slice runs as its own search
+        max_concurrent: optional, with slice_by, maximum number of slice searches running at a time
+        slice_retries: optional, with slice_by, number of times to rerun a slice that failed
+        dtypes: optional, dtype schema for the columns (see FrameBuilder), or 'infer' to use AQL.schema(aql)
+        format: optional, 'parquet', or 'arrow' for Arrow IPC files which are memory-mapped when scanned
+        stream_parse: optional, parse the rows of each page while it downloads, see search_iter
+        :return: lazy dataset of the results, scan it with to_table(columns=..., filter=...)
+        :rtype: pyarrow.dataset.Dataset
+        '''
+        writer = DatasetWriter(path, format=format)
+        dtypes = AQL.schema(aql) if dtypes == 'infer' else dtypes
+        stats = Stats('search', console=self.console, query=aql, path=path)
+        chunk_size = chunk_size or self.chunk_size
+        if slice_by:
+            if not start_time:
+                raise Exception('start_time is required to slice a search')
+            windows = self._time_windows(start_time, end_time or datetime.now(), slice_by)
+        else:
+            windows = [(start_time, end_time)]
+
+        def write_slice(window):
+            partition = time_slice(window[0])
+            # a failed attempt may have written part of the slice
+            writer.remove(self.console, partition)
+            rows = 0
+            builder = FrameBuilder(dtypes)
+            query = self._build_query(aql, start_time=window[0], end_time=window[1], limit=limit, priority=priority)
+            for page in self._search_pages(query, chunk_size, stats, stream_parse):
+                with stats.timer('build'):
+                    builder.add_rows(page)
+                if builder.rows >= chunk_size:
+                    rows += self._write_batch(writer, builder, partition, stats)
+                    builder = FrameBuilder(dtypes)
+            return rows + self._write_batch(writer, builder, partition, stats)
+
+        try:
+            self._run_slices(write_slice, windows, max_concurrent, slice_retries)
+        finally:
+            self._finish_stats(stats)
+        return writer.dataset()
+
+    def _write_batch(self, writer, builder, partition, stats) -> int:
+        with stats.timer('build'):
+            df = builder.build()
+        df['data_source'] = self.console
+        df['time_slice'] = partition
+        with stats.timer('write'):
+            writer.write(df)
+        return len(df)
+
+    @staticmethod
+    def _time_windows(start_time, end_time, slice_by) -> list:
+        windows = []
+        while start_time < end_time:
+            windows.append((start_time, min(start_time + slice_by, end_time)))
+            start_time += slice_by
+        return windows
+
+    def _run_slices(self, run, windows, max_concurrent, slice_retries) -> list:
+        # runs run(window) for each window on max_concurrent threads, rerunning failed windows on their own.
+        # run returns a DataFrame or a row count
+        def run_slice(window):
+            error = None
+            slice_start = time.time()
+            for attempt in range(1 + slice_retries):
+                try:
+                    result = run(window)
+                except Exception as e:
+                    self._log(f'Slice {window[0]} - {window[1]} failed on attempt {attempt + 1}: {e}')
+                    error = e
+                    continue
+                stats = {'start_time': window[0], 'end_time': window[1],
+                         'rows': result if isinstance(result, int) else len(result), 'attempts': attempt + 1,
+                         'seconds': time.time() - slice_start}
+                self._log(f"Slice {window[0]} - {window[1]}: {stats['rows']} rows in {stats['seconds']:.2f} sec")
+                return result, stats
+            raise Exception(f'Slice {window[0]} - {window[1]} failed after {slice_retries + 1} attempts') from error
 
+        with ThreadPoolExecutor(max_workers=max_concurrent) as pool:
+            results = list(pool.map(run_slice, windows))
+
+        # per slice timing and row counts of the latest sliced search
+        self.last_slice_stats = [stats for _, stats in results]
+        return [result for result, _ in results]
+
+    def _search_df_sliced(self, aql, start_time, end_time, slice_by, max_concurrent, slice_retries,
+                          **kwargs) -> pd.DataFrame:
+        windows = self._time_windows(start_time, end_time, slice_by)
+        return concat(self._run_slices(
+            lambda window: self._search_df(aql, start_time=window[0], end_time=window[1], **kwargs),
+            windows, max_concurrent, slice_retries))
+
+    # The helpers below hold what QRadar and AsyncQRadar share, apart from the I/O
+
+    # loading results sometimes fails and is retried by the retry policy. A Range request may be answered with 206
+    _RESULTS_STATUSES = (200, 206)
+
+    @staticmethod
+    def _credential_headers(username=None, password=None, token=None) -> dict:
+        # headers sent with every request to the console
+        headers = {'Accept': 'application/json'}
+        if username and password:
+            headers['username'] = username
+            headers['password'] = password
+        elif token:
+            headers['SEC'] = token
+        else:
+            raise Exception("No credentials supplied")
+        return headers
+
+    @staticmethod
+    def _search_url(console, search_id=None, results=False) -> str:
+        url = f'https://{console}/api/ariel/searches'
+        if search_id is not None:
+            url += f'/{search_id}'
+        return url + '/results' if results else url
+
+    @staticmethod
+    def _results_headers(start=None, end=None) -> dict:
+        return {'Range': f'items={start}-{end}'} if start is not None else {}
+
+    @staticmethod
+    def _unwrap_results(blob: dict) -> list:
+        # loads first (and only) value from json blob to get the data
+        # dict can be like {flows: []} or {events: []} or {cursor: []}
+        return list(blob.values())[0]
+
+    @staticmethod
+    def _poll_wait(polling, record, elapsed, polls, log):
+        '''
+        Handle a status record of a running search
+
+        :return: seconds to wait before the next status check, None once the search completed
+        '''
+        status = record.get('status')
+        log(f'Search running for {elapsed:.2f} sec')
+        if ('CANCELED' == status) or ('ERROR' == status):
+            raise Exception(f'Search did not finish, state is: {status}')
+        elif status == 'COMPLETED':
+            return None
+        return polling.next_interval(elapsed, record.get('progress'), polls)
+
+    @staticmethod
+    def _build_query(aql, start_time=None, end_time=None, limit=None, priority=None) -> str:
         # Build query with optional parameters for time, priority etc
         query = aql
         if limit:
@@ -150,92 +674,239 @@ class QRadar(object):
             query += f'\n START {start_epoch} STOP {end_epoch}'
         if priority and priority in ['LOW', 'NORMAL', 'HIGH']:
             query += f'\n PARAMETERS PRIORITY=\'{priority}\''
+        return query
 
+    def _run_search(self, query, stats) -> tuple:
         # Start search
         self._log(f'Search query: {query}')
-        search_id = self._start_search(query)
+        with stats.timer('start'):
+            search_id = self._start_search(query)
         self._log(f'Search ID: {search_id}')
+        stats.count('searches')
 
-        # Check search status until done
-        search_start = time.time()
+        # Check search status until done, time is counted as queued until Ariel reports it out of WAIT
+        search_start = last_poll = time.time()
         timeout = search_start + self.timeout * 60
+        polls = 0
         while time.time() < timeout:
-            status = self._get_status(search_id)
-            self._log(f'Search running for {time.time() - search_start:.2f} sec')
-            if ('CANCELED' == status) or ('ERROR' == status):
-                raise Exception(f'Search did not finish, state is: {status}')
-            elif status == 'COMPLETED':
+            record = self._get_search(search_id)
+            status = record.get('status')
+            now = time.time()
+            stats.count('polls')
+            stats.add_time('queue' if status == 'WAIT' else 'execute', now - last_poll)
+            last_poll = now
+            wait = self._poll_wait(self.polling, record, now - search_start, polls, self._log)
+            if wait is None:
                 break
-            time.sleep(5)  # wait 5 seconds to check again
+            polls += 1
+            time.sleep(max(min(wait, timeout - time.time()), 0))
         else:
             self._delete(search_id)
             raise Exception(f'Search did not finish within {self.timeout} minutes')
+        if 'query_execution_time' in record:
+            stats.count('ariel_execution_ms', record['query_execution_time'])
+        return search_id, record
 
-        # Load results list
-        results = self._get_results(search_id)
+    def _search_pages(self, query, chunk_size, stats, stream_parse=False):
+        if stream_parse and ijson is None:
+            raise Exception('stream_parse needs ijson, install it with: pip install ijson')
+        search_id, record = self._run_search(query, stats)
+        try:
+            yield from self._iter_results(search_id, record.get('record_count', 0), chunk_size, stats, stream_parse)
+        finally:
+            if self.cleanup_results:
+                self._delete(search_id)
 
-        if self.cleanup_results:
-            self._delete(search_id)
+    def _iter_results(self, search_id, record_count, chunk_size, stats, stream_parse=False):
+        # page through [0, record_count) with Range: items=x-y, no request is made past the last row.
+        # Pages are parsed whole by default, as the Range already bounds the memory of a page
+        for start in range(0, record_count, chunk_size):
+            end = min(start + chunk_size, record_count) - 1
+            if stream_parse:
+                yield from self._stream_results(search_id, start=start, end=end, stats=stats)
+            else:
+                yield self._get_results(search_id, start=start, end=end, stats=stats)
 
-        return results
+    def _get_results_parallel(self, search_id, record_count, chunk_size, workers, stats):
+        # split [0, record_count) into Range windows and load them on the session's keep-alive connections,
+        # pool.map yields the pages in the order of the windows as soon as each is loaded
+        ranges = [(start, min(start + chunk_size, record_count) - 1) for start in range(0, record_count, chunk_size)]
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            yield from pool.map(lambda r: self._get_results(search_id, start=r[0], end=r[1], stats=stats), ranges)
 
-    def search_df(self, aql, start_time=None, end_time=None, limit=None, priority=None) -> pd.DataFrame:
-        '''
-        aql: A string containing the QRadar search in AQL form
-        start_time: optional, datetime() object for search start time.  Can also be part of search string
-        end_time: optional,  datetime() object for search start time.  Can also be part of search string
-        limit: optional, limit search to this many result rows.  Can also be part of search string
-        priority: optional, priority to run search as: LOW/NORMAL/HIGH.  Can also be part of search string
-        :return: DataFrame of results
-        :rtype: pandas.DataFrame
-        '''
-        results = self.search(aql, start_time=start_time, end_time=end_time, limit=limit, priority=priority)
-        df = pd.DataFrame(results)
-        return df
+    def _call(self, method, url, stats=None, **kwargs):
+        # every request to the console is paced by the rate limiter, and transient failures are retried
+        return send(self.session, method, url, self.retry_policy, self.rate_limiter, stats=stats, log=self._log,
+                    verify=False, proxies=self.proxy, **kwargs)
 
     def _start_search(self, query) -> str:
         # start search
-        headers = self._get_headers()
-        headers['Content-Type'] = 'application/x-www-form-urlencoded'
-        url = f'https://{self.console}/api/ariel/searches'
-        resp = requests.post(url, headers=headers, verify=False, data={'query_expression': query}, proxies=self.proxy)
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        url = self._search_url(self.console)
+        resp = self._call('POST', url, headers=headers, data={'query_expression': query})
         if resp.status_code != 201:
             self._log(resp.content)
             raise Exception('Cannot start search')
         return resp.json().get('search_id')
 
-    def _get_status(self, search_id) -> str:
-        url = f'https://{self.console}/api/ariel/searches/{search_id}'
-        resp = requests.get(url, headers=self._get_headers(), verify=False, proxies=self.proxy)
+    def _get_search(self, search_id) -> dict:
+        # status record of the search, including status, progress and record_count
+        resp = self._call('GET', self._search_url(self.console, search_id))
         resp_json = resp.json()
-        status = resp_json.get('status')
-        self._log(f"Search {status} and {resp_json.get('progress')}% complete")
-        return status
+        self._log(f"Search {resp_json.get('status')} and {resp_json.get('progress')}% complete")
+        return resp_json
 
-    def _get_results(self, search_id, attempt=0) -> list:
+    def _get_results(self, search_id, start=None, end=None, stats=None) -> list:
         """
         :param search_id:
-        :param attempt:
+        :param start: optional, index of first row to load (inclusive)
+        :param end: optional, index of last row to load (inclusive)
+        :param stats: optional, Stats to count the download and parsing in
         :return: List of results
         :rtype: list []
         """
-        url = f'https://{self.console}/api/ariel/searches/{search_id}/results'
-        resp = requests.get(url, headers=self._get_headers(), verify=False, proxies=self.proxy)
+        stats = stats or Stats('results')
+        with stats.timer('download'):
+            resp = self._request_results(search_id, start=start, end=end, stats=stats)
+            content = resp.content
+        stats.count('bytes', len(content))
 
-        # retry loading results, sometimes fails
-        if resp.status_code != 200:
-            self._log(resp.content)
-            if attempt <= 10:
-                time.sleep(5)
-                return self._get_results(search_id, attempt=attempt + 1)
-            else:
-                raise Exception("Could not load search results")
+        with stats.timer('parse'):
+            rows = self._unwrap_results(_json_loads(content))
+        stats.count('rows', len(rows))
+        return rows
 
-        # loads first (and only) value from json blob to get the data
-        # dict can be like {flows: []} or {events: []} or {cursor: []}
-        return list(resp.json().values())[0]
+    def _stream_results(self, search_id, start=None, end=None, stats=None):
+        """
+        Load results like _get_results, parsing rows with ijson while the response is downloaded
+
+        :return: generator of lists of row dicts
+        """
+        stats = stats or Stats('results')
+        # download and parse overlap: time waiting for bytes is download, the rest of the time in the parser is parse
+        download, parse, size = 0.0, 0.0, 0
+
+        def timed_chunks(chunks):
+            nonlocal download, size
+            while True:
+                chunk_start = time.time()
+                chunk = next(chunks, None)
+                download += time.time() - chunk_start
+                if chunk is None:
+                    return
+                size += len(chunk)
+                yield chunk
+
+        request_start = time.time()
+        try:
+            with self._request_results(search_id, start=start, end=end, stream=True, stats=stats) as resp:
+                download += time.time() - request_start
+                rows_iter = _iter_json_rows(timed_chunks(resp.iter_content(chunk_size=256 * 1024)))
+                while True:
+                    parse_start, download_before = time.time(), download
+                    rows = next(rows_iter, None)
+                    parse += time.time() - parse_start - (download - download_before)
+                    if rows is None:
+                        break
+                    stats.count('rows', len(rows))
+                    yield rows
+        finally:
+            stats.add_time('download', download)
+            stats.add_time('parse', parse)
+            stats.count('bytes', size)
+
+    def _request_results(self, search_id, start=None, end=None, stream=False, stats=None):
+        url = self._search_url(self.console, search_id, results=True)
+        resp = self._call('GET', url, stats=stats, headers=self._results_headers(start, end), stream=stream)
+        if resp.status_code not in self._RESULTS_STATUSES:
+            self._log(resp.content)
+            resp.close()
+            raise Exception("Could not load search results")
+        return resp
 
     def _delete(self, search_id):
-        url = f'https://{self.console}/api/ariel/searches/{search_id}'
-        requests.delete(url, headers=self._get_headers(), verify=False, proxies=self.proxy)
+        self._call('DELETE', self._search_url(self.console, search_id))
         self._log(f'Deleted search cursor {search_id}')
+
+    def close(self):
+        self.session.close()
+
+    def incremental_search(self, aql, window=timedelta(hours=24), bucket=timedelta(hours=1), time_column=None,
+                           max_concurrent=4, settle=timedelta(minutes=5), **kwargs):
+        '''
+        aql: A string containing the QRadar search in AQL form, without a time-frame
+        window: timedelta() of the sliding window to keep results for, for example the last 24 hours
+        bucket: timedelta() the window is split into, complete buckets are only searched once
+        time_column: optional, column with the event time in epoch milliseconds, used to drop rows older than the window
+        max_concurrent: maximum number of bucket searches running at a time
+        settle: timedelta() after the end of a bucket during which late events can still arrive in it,
+                buckets are only kept once settled
+        kwargs: other arguments for search_df, like limit or priority
+        :return: IncrementalSearch, call refresh() on it to get the results of the current window
+        :rtype: IncrementalSearch
+        '''
+        return IncrementalSearch(self, aql, window=window, bucket=bucket, time_column=time_column,
+                                 max_concurrent=max_concurrent, settle=settle, **kwargs)
+
+
+class IncrementalSearch(object):
+    '''
+    Keeps the results of a search over a sliding time window, like the last 24 hours.
+    The window is split into time buckets aligned to epoch multiples of the bucket size. Buckets are kept once they
+    ended at least settle ago, as events can reach QRadar after their time, so each refresh() only searches the buckets
+    which are not settled yet and any gap since the previous refresh. Unsettled buckets are searched whole, so a
+    refresh costs a search of up to bucket + settle of events however recently the previous refresh ran.
+    Aggregating searches should group by a time slice no longer than the bucket, like the timeslice in AQL.proxy_model.
+    '''
+
+    def __init__(self, qradar, aql, window=timedelta(hours=24), bucket=timedelta(hours=1), time_column=None,
+                 max_concurrent=4, settle=timedelta(minutes=5), **kwargs):
+        self.qradar = qradar
+        self.aql = aql
+        self.window = window
+        self.bucket = bucket
+        self.time_column = time_column
+        self.max_concurrent = max_concurrent
+        self.settle = settle
+        self.kwargs = kwargs
+        self.buckets = {}  # start of bucket -> DataFrame, only for settled buckets
+
+    def _floor(self, t) -> datetime:
+        size = self.bucket.total_seconds()
+        return datetime.fromtimestamp(t.timestamp() // size * size, tz=t.tzinfo)
+
+    def refresh(self, now=None) -> pd.DataFrame:
+        '''
+        now: optional, datetime() object for the end of the window, defaults to the current time
+        :return: DataFrame of results in the window
+        :rtype: pandas.DataFrame
+        '''
+        now = now or datetime.now()
+        window_start = now - self.window
+
+        # drop buckets which aged out of the window
+        first = self._floor(window_start)
+        self.buckets = {start: df for start, df in self.buckets.items() if start >= first}
+
+        starts = []
+        start = first
+        while start < now:
+            starts.append(start)
+            start += self.bucket
+        missing = [start for start in starts if start not in self.buckets]
+        self.qradar._log(f'Incremental search: {len(starts) - len(missing)} buckets kept, {len(missing)} to search')
+
+        def run_bucket(start):
+            return self.qradar.search_df(self.aql, start_time=start, end_time=min(start + self.bucket, now),
+                                         **self.kwargs)
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrent) as pool:
+            loaded = dict(zip(missing, pool.map(run_bucket, missing)))
+
+        # buckets still open, or which may still get late events, are searched again on the next refresh
+        self.buckets.update({start: df for start, df in loaded.items() if start + self.bucket + self.settle <= now})
+
+        df = concat([self.buckets.get(start, loaded.get(start)) for start in starts])
+        if self.time_column and self.time_column in df:
+            df = df[df[self.time_column] >= window_start.timestamp() * 1000].reset_index(drop=True)
+        return df
@@ -0,0 +1,244 @@
+#
+# Copyright (C) 2020 IBM. All Rights Reserved.
+#
+# See LICENSE file in the root directory
+# of this source tree for licensing information.
+#
+
+import copy
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests import Response
+
+from .stats import Stats
+
+# refused or failed before being processed, worth trying again
+TRANSIENT_STATUSES = frozenset([408, 425, 429, 500, 502, 503, 504])
+# the server refused the request without processing it, so any method can be sent again
+REFUSED_STATUSES = frozenset([429, 503])
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+
+
+class RetryPolicy(object):
+    '''
+    Decides whether and how long to wait before a failed request is sent again.
+    Only transient failures are retried: connection errors and transient statuses of idempotent requests,
+    and 429 or 503 of any request. Waits grow exponentially with full jitter, so concurrent workers
+    which failed together do not retry together, and a Retry-After sent by the server is waited at least.
+    '''
+
+    def __init__(self, retries=3, backoff=0.5, factor=2.0, max_backoff=30.0, max_elapsed=300.0,
+                 statuses=TRANSIENT_STATUSES, methods=IDEMPOTENT_METHODS):
+        '''
+        :param retries: most times a request is sent again
+        :param backoff: seconds to wait at most before the first retry
+        :param factor: growth of the longest wait after every retry
+        :param max_backoff: longest wait before a retry, in seconds, unless the server asks for longer
+        :param max_elapsed: no retry is made which would end later than this many seconds after the first attempt
+        :param statuses: HTTP status codes worth retrying
+        :param methods: HTTP methods which are safe to send again
+        '''
+        self.retries = retries
+        self.backoff = backoff
+        self.factor = factor
+        self.max_backoff = max_backoff
+        self.max_elapsed = max_elapsed
+        self.statuses = frozenset(statuses)
+        self.methods = frozenset(m.upper() for m in methods)
+
+    def copy(self, **changes):
+        '''
+        :return: a copy of the policy with some settings changed, settings given as None are kept
+        :rtype: RetryPolicy
+        '''
+        policy = copy.copy(self)
+        for name, value in changes.items():
+            if value is not None:
+                setattr(policy, name, value)
+        return policy
+
+    def retryable(self, method, status=None, error=False) -> bool:
+        '''
+        :param method: HTTP method of the request
+        :param status: HTTP status code of the response, None if there was no response
+        :param error: the request failed with a connection error or timeout
+        :return: the failure is transient and the request is safe to send again
+        :rtype: bool
+        '''
+        if status in REFUSED_STATUSES and status in self.statuses:
+            return True
+        if method.upper() not in self.methods:
+            return False
+        return error or status in self.statuses
+
+    def next_wait(self, method, attempt, elapsed, status=None, error=False, retry_after=None):
+        '''
+        :param method: HTTP method of the request
+        :param attempt: number of retries done so far
+        :param elapsed: seconds since the first attempt
+        :param status: HTTP status code of the response, None if there was no response
+        :param error: the request failed with a connection error or timeout
+        :param retry_after: seconds the server asked to wait, from its Retry-After header
+        :return: seconds to wait before the next attempt, or None to give up
+        '''
+        if attempt >= self.retries or not self.retryable(method, status, error):
+            return None
+        wait = random.uniform(0, min(self.max_backoff, self.backoff * self.factor ** attempt))
+        if retry_after is not None:
+            # jitter after the time asked for, as every worker was told the same time
+            wait += retry_after
+        if elapsed + wait > self.max_elapsed:
+            return None
+        return wait
+
+    def after_failure(self, method, attempt, first, status=None, error=None, headers=None, url=None, limiter=None,
+                      log=None):
+        '''
+        Decide what to do after a failed attempt, shared by send() and the asyncio clients which only do the waiting.
+        A Retry-After in headers holds every request to the endpoint of url in the limiter.
+
+        :param method: HTTP method of the request
+        :param attempt: number of retries done so far
+        :param first: time.time() of the first attempt
+        :param status: HTTP status code of the response, None if there was no response
+        :param error: exception the request failed with, None if there was a response
+        :param headers: headers of the response
+        :param url: URL of the request
+        :param limiter: optional, RateLimiter pacing the requests to url
+        :param log: optional, callable to log the retry with
+        :return: seconds to wait before the next attempt, or None to give up
+        '''
+        retry_after = self.parse_retry_after((headers or {}).get('Retry-After'))
+        if retry_after and limiter is not None:
+            limiter.pause(url, retry_after)
+        wait = self.next_wait(method, attempt, time.time() - first, status=status, error=error is not None,
+                              retry_after=retry_after)
+        if wait is not None and log:
+            log(f'{method} {url} failed with {status or error}, retry {attempt + 1} in {wait:.2f} sec')
+        return wait
+
+    @staticmethod
+    def parse_retry_after(value):
+        '''
+        :param value: Retry-After header, in seconds or an HTTP date
+        :return: seconds to wait, or None if there is no valid header
+        '''
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+class RateLimiter(object):
+    '''
+    Token buckets limiting the requests sent to each endpoint (scheme, host and port),
+    shared by all the threads or tasks of a client. When an endpoint asks to wait with Retry-After,
+    every request to it waits, spread over jitter seconds afterwards.
+    '''
+
+    def __init__(self, rate=None, burst=None, jitter=1.0):
+        '''
+        :param rate: requests per second to each endpoint, None for no limit
+        :param burst: requests which can be sent at once after a quiet time, by default one second of rate
+        :param jitter: seconds to spread the requests over when an endpoint stops asking to wait
+        '''
+        self.rate = rate
+        self.burst = burst or max(1.0, rate or 1.0)
+        self.jitter = jitter
+        self._buckets = {}  # endpoint -> {'tokens', 'updated', 'paused_until'}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def endpoint(url) -> str:
+        parts = urlsplit(url)
+        return f'{parts.scheme}://{parts.netloc}'
+
+    def _bucket(self, url, now) -> dict:
+        key = self.endpoint(url)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = {'tokens': self.burst, 'updated': now, 'paused_until': 0.0}
+        return bucket
+
+    def reserve(self, url) -> float:
+        '''
+        Take a token for a request to the endpoint of url
+
+        :return: seconds to wait before sending the request
+        :rtype: float
+        '''
+        with self._lock:
+            now = time.monotonic()
+            bucket = self._bucket(url, now)
+            wait = 0.0
+            if bucket['paused_until'] > now:
+                wait = bucket['paused_until'] - now + random.uniform(0, self.jitter)
+            if self.rate:
+                bucket['tokens'] = min(self.burst, bucket['tokens'] + (now - bucket['updated']) * self.rate)
+                bucket['updated'] = now
+                # tokens go below zero to queue the requests behind each other
+                bucket['tokens'] -= 1
+                if bucket['tokens'] < 0:
+                    wait = max(wait, -bucket['tokens'] / self.rate)
+            return wait
+
+    def pause(self, url, seconds):
+        '''
+        Hold the requests to the endpoint of url for seconds, like a Retry-After asks
+        '''
+        with self._lock:
+            now = time.monotonic()
+            bucket = self._bucket(url, now)
+            bucket['paused_until'] = max(bucket['paused_until'], now + seconds)
+
+
+def send(session: requests.Session, method, url, policy: RetryPolicy, limiter: RateLimiter = None,
+         stats: Stats = None, log=None, **kwargs) -> Response:
+    '''
+    Send a request with the session, retried by the policy and paced by the limiter
+
+    :param kwargs: arguments of session.request, like params, json, headers or stream
+    :return: the successful response, or the last failed one once the policy gives up
+    :rtype: requests.Response
+    '''
+    stats = stats or Stats('request')
+    first = time.time()
+    attempt = 0
+    while True:
+        if limiter is not None:
+            wait = limiter.reserve(url)
+            if wait > 0:
+                with stats.timer('throttle'):
+                    time.sleep(wait)
+        try:
+            resp, error = session.request(method, url, **kwargs), None
+        except (requests.ConnectionError, requests.Timeout) as e:
+            resp, error = None, e
+        stats.count('requests')
+        if error is None and resp.status_code < 400:
+            return resp
+
+        wait = policy.after_failure(method, attempt, first, status=resp.status_code if resp is not None else None,
+                                    error=error, headers=resp.headers if resp is not None else None, url=url,
+                                    limiter=limiter, log=log)
+        if wait is None:
+            if error is not None:
+                raise error
+            return resp
+        if resp is not None:
+            resp.close()
+        stats.count('retries')
+        with stats.timer('retry_wait'):
+            time.sleep(wait)
+        attempt += 1
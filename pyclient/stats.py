@@ -0,0 +1,110 @@
+#
+# Copyright (C) 2020 IBM. All Rights Reserved.
+#
+# See LICENSE file in the root directory
+# of this source tree for licensing information.
+#
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Stats(object):
+    '''
+    Timings and counters of one search or request, to find where its time went.
+    Phases are seconds spent in each step, summed over threads when the work runs in parallel,
+    counters are things like requests, bytes, polls, retries and rows.
+    '''
+
+    def __init__(self, kind, **labels):
+        '''
+        :param kind: what is measured, like 'search' or 'request'
+        :param labels: details to report with the stats, like the query or url
+        '''
+        self.kind = kind
+        self.labels = labels
+        self.phases = {}
+        self.counters = {}
+        self.started = time.time()
+        self.seconds = None  # wall time, set by finish()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'Stats({self.as_dict()})'
+
+    @contextmanager
+    def timer(self, phase):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.time() - start)
+
+    def add_time(self, phase, seconds):
+        with self._lock:
+            self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def count(self, counter, n=1):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def merge(self, other):
+        '''
+        Add the phases and counters of other, like the stats of one of the parallel parts of a search
+
+        :param other: Stats to add
+        '''
+        with other._lock:
+            phases, counters = dict(other.phases), dict(other.counters)
+        for phase, seconds in phases.items():
+            self.add_time(phase, seconds)
+        for counter, n in counters.items():
+            self.count(counter, n)
+
+    @property
+    def rows_per_second(self) -> float:
+        seconds = self.seconds if self.seconds is not None else time.time() - self.started
+        return self.counters.get('rows', 0) / seconds if seconds else 0.0
+
+    def finish(self, hooks=()):
+        '''
+        Stop the wall clock and pass the stats to each hook
+
+        :param hooks: callables taking the Stats object
+        '''
+        self.seconds = time.time() - self.started
+        for hook in hooks:
+            hook(self)
+
+    def as_dict(self) -> dict:
+        '''
+        :return: flat dict of the labels, wall time, phases as <phase>_seconds and counters
+        :rtype: dict
+        '''
+        result = {'kind': self.kind, 'started': self.started, 'seconds': self.seconds,
+                  'rows_per_second': self.rows_per_second}
+        result.update(self.labels)
+        result.update({f'{phase}_seconds': seconds for phase, seconds in self.phases.items()})
+        result.update(self.counters)
+        return result
+
+
+class JsonLinesSink(object):
+    '''
+    A hook which appends the stats of every search or request to a local JSON lines file
+    '''
+
+    def __init__(self, path):
+        '''
+        :param path: file to append to
+        '''
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, stats: Stats):
+        line = json.dumps(stats.as_dict(), default=str)
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(line + '\n')
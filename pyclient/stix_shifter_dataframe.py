@@ -1,104 +1,353 @@
 import json
 import time
 import logging
+import threading
 import pandas as pd
-from anytree import Node, PreOrderIter
-from pandas import json_normalize
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, wait
 from stix_shifter.stix_translation import stix_translation
 from stix_shifter.stix_transmission import stix_transmission
+from .dataset import DatasetWriter
+from .frames import FrameBuilder, aggregate, named_aggs
+from .stats import Stats
+
+
+def _normalize(d: dict, prefix: str = '', level: int = 0):
+    # Same columns and order as pandas.json_normalize on a single dict: top level dicts are moved to the end,
+    # nested keys are joined with '.', and empty dicts are dropped
+    flat, nested = {}, []
+    for k, v in d.items():
+        if isinstance(v, dict):
+            if level:
+                flat.update(_normalize(v, f'{prefix}{k}.', level + 1))
+            else:
+                nested.append((k, v))
+        else:
+            flat[prefix + k] = v
+    for k, v in nested:
+        flat.update(_normalize(v, f'{prefix}{k}.', level + 1))
+    return flat
+
+
+def _shape(attr: str, val):
+    # The part of an SCO property which decides the flattened columns: the type, the reference targets,
+    # the length of lists and whether the value is a dict
+    if attr == 'type' or attr.endswith('_ref'):
+        return val
+    if attr.endswith('_refs'):
+        return tuple(val)
+    if isinstance(val, list):
+        return len(val)
+    if isinstance(val, dict):
+        return dict
+    return None
+
+
+class _Node(object):
+    __slots__ = ('key', 'fields', 'parent', 'prefix', 'children')
+
+    def __init__(self, key, fields, parent=None, prefix=None):
+        self.key = key
+        self.fields = fields
+        self.parent = None
+        self.prefix = prefix
+        self.children = []
+        if parent is not None:
+            self.set_parent(parent)
+
+    def set_parent(self, parent):
+        if self.parent is not None:
+            self.parent.children.remove(self)
+        self.parent = parent
+        parent.children.append(self)
+
+    def is_ancestor_of(self, node):
+        while node is not None:
+            if node is self:
+                return True
+            node = node.parent
+        return False
+
+    @property
+    def root(self):
+        node = self
+        while node.parent is not None:
+            node = node.parent
+        return node
 
 
 class StixShifterDataFrame(object):
-    def __init__(self):
+    def __init__(self, max_workers=8, page_size=1000, template_cache_size=256, hooks=None, dsl_cache_size=256):
         self.configs = {}
+        self.max_workers = max_workers  # data sources and translated queries executed concurrently
+        # Connector calls of all the data sources and their translated queries share max_workers slots
+        self._connector_slots = threading.BoundedSemaphore(max_workers)
+        self.page_size = page_size  # records fetched per transmission results call
+        self.last_errors = {}  # config name -> exception, of the data sources which failed in the latest search_df
+        # Stats of the latest search, passed to each of hooks (callables, like a JsonLinesSink) when it finishes
+        self.hooks = list(hooks or [])
+        self.last_search_stats = None
 
+        # LRU cache of the compiled flattening templates, by SCO graph shape
+        self.template_cache_size = template_cache_size
+        self.template_hits = 0
+        self.template_misses = 0
+        self._templates = OrderedDict()
+        self._template_lock = threading.Lock()
 
-    def add_config(self, config_name: str, config_content: dict):
+        # Reused across queries: one translation, a transmission per config, and an LRU cache of the translated
+        # patterns by (translation_module, pattern, options)
+        self.translation = stix_translation.StixTranslation()
+        self._transmissions = {}
+        self.dsl_cache_size = dsl_cache_size
+        self._dsl_cache = OrderedDict()
+        self._setup_lock = threading.Lock()
+
+
+    def add_config(self, config_name: str, config_content: dict, warm_up_patterns: list = None):
         if 'connection' not in config_content or 'configuration' not in config_content:
             raise Exception('connection and configuration should be in config.')
 
         # TODO: add protect mechanism in case any accidental overwrite.
         self.configs.update({config_name: config_content})
+        self._transmissions.pop(config_name, None)
+        if warm_up_patterns is not None:
+            self.warm_up([config_name], warm_up_patterns)
 
 
-    def stix_shiter_execute(self, config_name: str, stix_query: str):
-        # Execute means take the STIX SCO pattern as input, execute query, and return STIX as output
-        # ref: https://github.com/opencybersecurityalliance/stix-shifter/blob/ee4bdf754fc9c2a80cb5b5607210e53dd2657b72/stix_shifter/scripts/stix_shifter.py#L251
-        # TODO: wrapper stix-shifter's cml tool to be function to replace this method.
+    def warm_up(self, config_names: list = None, patterns: list = None):
+        # Create the transmissions and translate the patterns ahead of the searches
+        for cfn in config_names or list(self.configs):
+            self._get_transmission(cfn)
+            for pattern in patterns or []:
+                self._translate_query(cfn, pattern)
+
+
+    def _check_config(self, config_name: str):
         config = self.configs[config_name]
         if 'translation_module' not in config or 'transmission_module' not in config \
                 or 'connection' not in config or 'configuration' not in config:
             raise Exception('transmission_module, translation_module, connection and configuration should be in config.')
+        return config
+
+
+    def _get_transmission(self, config_name: str):
+        # The transmission, and the connection state it keeps, is created once per config
+        with self._setup_lock:
+            transmission = self._transmissions.get(config_name)
+            if transmission is None:
+                config = self._check_config(config_name)
+                transmission = stix_transmission.StixTransmission(config['transmission_module'], config['connection'], config['configuration'])
+                self._transmissions[config_name] = transmission
+        return transmission
 
-        connection_dict, configuration_dict = config['connection'], config['configuration'],
-        translation_module, transmission_module, data_source = config['translation_module'], config['transmission_module'], {}
+
+    def _translate_query(self, config_name: str, stix_query: str):
+        config = self._check_config(config_name)
+        connection_dict = config['connection']
+        translation_module, data_source = config['translation_module'], {}
         options = {}
 
         if 'options' in connection_dict:
             options.update(connection_dict['options'])
         options['validate_pattern'] = True
 
-        translation = stix_translation.StixTranslation()
-        dsl = translation.translate(translation_module, 'query', data_source, stix_query, options)
+        key = (translation_module, stix_query, json.dumps(options, sort_keys=True, default=str))
+        with self._setup_lock:
+            dsl = self._dsl_cache.get(key)
+            if dsl is not None:
+                self._dsl_cache.move_to_end(key)
+                return dsl
+
+        dsl = self.translation.translate(translation_module, 'query', data_source, stix_query, options)
         logging.debug('Translated Queries: ' + json.dumps(dsl))
+        if 'queries' in dsl:
+            # Failed translations are not kept, so they are retried
+            with self._setup_lock:
+                self._dsl_cache[key] = dsl
+                if len(self._dsl_cache) > self.dsl_cache_size:
+                    self._dsl_cache.popitem(last=False)
+        return dsl
 
-        transmission = stix_transmission.StixTransmission(transmission_module, connection_dict, configuration_dict)
+
+    def _setup(self, config_name: str, stix_query: str, stats: Stats):
+        # Translate the STIX pattern, and get the transmission for the data source
+        with stats.timer('translate_query'):
+            return self.translation, self._get_transmission(config_name), self._translate_query(config_name, stix_query)
+
+
+    def _translate_results(self, config_name: str, translation, results: list, stats: Stats):
+        config = self.configs[config_name]
+        with stats.timer('translate_results'):
+            return translation.translate(config['translation_module'], 'results', config['data_source'], json.dumps(results), {"stix_validator": True})
+
+
+    def _finish_stats(self, stats: Stats):
+        self.last_search_stats = stats
+        stats.finish(self.hooks)
+        logging.debug(stats)
+
+
+    def stix_shiter_execute(self, config_name: str, stix_query: str, stats: Stats = None):
+        # Execute means take the STIX SCO pattern as input, execute query, and return STIX as output
+        # ref: https://github.com/opencybersecurityalliance/stix-shifter/blob/ee4bdf754fc9c2a80cb5b5607210e53dd2657b72/stix_shifter/scripts/stix_shifter.py#L251
+        # TODO: wrapper stix-shifter's cml tool to be function to replace this method.
+        # stats: optional, Stats to add the phase timings and counters to
+        stats = stats or Stats('execute', config_name=config_name, query=stix_query)
+        translation, transmission, dsl = self._setup(config_name, stix_query, stats)
         results = []
+        # Run the translated queries concurrently, and collect all results in query order
+        queries = dsl['queries']
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(queries)))) as executor:
+            for data in executor.map(lambda query: self._transmit_query(transmission, query, stats), queries):
+                results += data
+
+        # Translate results to STIX
+        return self._translate_results(config_name, translation, results, stats)
+
+
+    def stix_shiter_execute_iter(self, config_name: str, stix_query: str, page_size: int = None, stats: Stats = None):
+        # Like stix_shiter_execute, but yields one STIX bundle per page of page_size records,
+        # so only one page of a data source's results is held at a time
+        stats = stats or Stats('execute', config_name=config_name, query=stix_query)
+        translation, transmission, dsl = self._setup(config_name, stix_query, stats)
         for query in dsl['queries']:
-            search_result = transmission.query(query)
-            if search_result["success"]:
-                search_id = search_result["search_id"]
+            for data in self._transmit_query_pages(transmission, query, page_size or self.page_size, stats):
+                yield self._translate_results(config_name, translation, data, stats)
+
+
+    def _connector_call(self, call, *args):
+        # At most max_workers connector calls run at once, however the data sources and queries are threaded
+        with self._connector_slots:
+            return call(*args)
+
+
+    def _transmit_query(self, transmission, query, stats: Stats):
+        results = []
+        for data in self._transmit_query_pages(transmission, query, self.page_size, stats):
+            results += data
+        return results
+
+
+    def _transmit_query_pages(self, transmission, query, page_size, stats: Stats):
+        # Time in the transmission calls is counted as transmit, not the time the caller takes with each page
+        with stats.timer('transmit'):
+            search_result = self._connector_call(transmission.query, query)
+        stats.count('queries')
+        if search_result["success"]:
+            search_id = search_result["search_id"]
 
-                if transmission.is_async():
+            if transmission.is_async():
+                with stats.timer('transmit'):
                     time.sleep(1)
-                    status = transmission.status(search_id)
+                    status = self._connector_call(transmission.status, search_id)
+                    stats.count('polls')
                     if status['success']:
                         while status['progress'] < 100 and status['status'] == 'RUNNING':
                             logging.debug(status)
-                            status = transmission.status(search_id)
+                            status = self._connector_call(transmission.status, search_id)
+                            stats.count('polls')
                         logging.debug(status)
                     else:
                         raise RuntimeError("Fetching status failed")
-                # TODO: allow user to pass No. of records
-                result = transmission.results(search_id, 0, 1000)
-                if result["success"]:
-                    logging.debug("Search {} results is:\n{}".format(search_id, result["data"]))
-
-                    # Collect all results
-                    results += result["data"]
-                else:
+            # Fetch pages until the data source has no more records
+            offset = 0
+            while True:
+                with stats.timer('transmit'):
+                    result = self._connector_call(transmission.results, search_id, offset, page_size)
+                stats.count('pages')
+                if not result["success"]:
                     raise RuntimeError("Fetching results failed; see log for details")
-            else:
-                logging.error(str(search_result))
-                raise Exception(str(search_result)) # TODO: how to deal with this situation
+                data = result["data"]
+                logging.debug("Search {} results {}-{} is:\n{}".format(search_id, offset, offset + len(data), data))
+                stats.count('records', len(data))
+                if data:
+                    yield data
+                if len(data) < page_size:
+                    break
+                offset += page_size
+        else:
+            logging.error(str(search_result))
+            raise Exception(str(search_result)) # TODO: how to deal with this situation
 
-        # Translate results to STIX
-        data_source = config['data_source']
-        result = translation.translate(translation_module, 'results', data_source, json.dumps(results), {"stix_validator": True})
-        return result
 
-
-    def stix2dataframe(self, stix):
-        def obj2df(obj):
-            return [df_ for df_ in self.flatten_sco(obj) if isinstance(df_, pd.DataFrame)]
-
-        dfs = []
-        for ldf in list(map(lambda obj: obj2df(obj), stix['objects'])):
-            dfs.extend(ldf)
-
-        return pd.concat(dfs) if dfs else pd.DataFrame()
+    def stix2dataframe(self, stix, stats: Stats = None, columns: list = None):
+        # One pass over the bundle: each observed-data object becomes a row of flat STIX paths,
+        # and the DataFrame is built from the rows once at the end.
+        # With columns, only those columns are ever flattened, in that order
+        start = time.time()
+        keep = frozenset(columns) if columns is not None else None
+        builder = FrameBuilder()
+        for obj in stix['objects']:
+            if obj['type'] == 'observed-data':
+                builder.add_row(self.flatten_observed_data(obj, keep))
+        df = builder.build()
+        if columns is not None:
+            df = df.reindex(columns=list(columns))
+        if stats is not None:
+            stats.add_time('flatten', time.time() - start)
+            stats.count('rows', len(df))
+        return df
 
 
     def flatten_sco(self, obj, viewname='observed-data'):
         # This method is contributed by @pcoccoli
         if obj['type'] != 'observed-data':
             return [obj]
+        return [pd.DataFrame([self.flatten_observed_data(obj)])]
+
+
+    def flatten_observed_data(self, obj, columns: frozenset = None):
+        # Returns a dict of the "flat" STIX path to each SCO property of an observed-data object,
+        # like 'ipv4-addr:value' or 'network-traffic:src_ref.value', plus the normalized envelope.
+        # With columns, only those paths are returned
         objs = obj['objects']
+        result = _normalize({key: obj[key] for key in obj.keys() if key != 'objects'})
+        if columns is not None:
+            result = {key: value for key, value in result.items() if key in columns}
+        for column, k, attr, i in self._get_template(objs, columns):
+            result[column] = objs[k][attr] if i is None else objs[k][attr][i]
+        return result
+
+
+    def template_cache_info(self):
+        # Counters of the flattening template cache, to check the hit rate on real bundles
+        lookups = self.template_hits + self.template_misses
+        return {'hits': self.template_hits, 'misses': self.template_misses, 'size': len(self._templates),
+                'maxsize': self.template_cache_size, 'hit_rate': self.template_hits / lookups if lookups else 0.0}
+
+
+    def _get_template(self, objs, columns: frozenset = None):
+        # Connectors produce few distinct SCO graph shapes, so the graph is only walked once per shape
+        # (and set of columns to keep)
+        shape = tuple((k, tuple((attr, _shape(attr, val)) for attr, val in v.items())) for k, v in objs.items())
+        if columns is not None:
+            shape = (columns, shape)
+        with self._template_lock:
+            template = self._templates.get(shape)
+            if template is not None:
+                self._templates.move_to_end(shape)
+                self.template_hits += 1
+                return template
+            self.template_misses += 1
+
+        template = self._compile_template(objs)
+        if columns is not None:
+            template = [entry for entry in template if entry[0] in columns]
+        with self._template_lock:
+            self._templates[shape] = template
+            if len(self._templates) > self.template_cache_size:
+                self._templates.popitem(last=False)
+        return template
+
+
+    def _compile_template(self, objs):
+        # Returns the list of (column, SCO key, property, list index) to read an observed-data object of this shape
         nodes = {}
 
         # Create a node for each SCO
         for k, v in objs.items():
-            nodes[k] = Node(k, fields=v)
+            nodes[k] = _Node(k, v)
 
         # Arrange the nodes into trees by references
         for k, v in objs.items():
@@ -110,64 +359,177 @@ class StixShifterDataFrame(object):
                     if nodes[val].parent:
                         # Already have a parent, so create a new node
                         nid = str(len(nodes))
-                        new_node = Node(nid, parent=nodes[k], fields=nodes[val].fields)
-                        nodes[nid] = new_node
-                        nodes[nid].prefix = attr
-                    else:
-                        nodes[val].parent = nodes[k]
+                        nodes[nid] = _Node(nodes[val].key, nodes[val].fields, parent=nodes[k], prefix=attr)
+                    elif not nodes[val].is_ancestor_of(nodes[k]):
+                        nodes[val].set_parent(nodes[k])
                         nodes[val].prefix = attr
                 elif attr.endswith('_refs'):
                     for i, ref in enumerate(val):
-                        if ref == k:
-                           # preventing circular references
+                        if ref == k or nodes[ref].is_ancestor_of(nodes[k]):
+                            # preventing circular references
                             continue
-                        nodes[ref].parent = nodes[k]
+                        nodes[ref].set_parent(nodes[k])
                         nodes[ref].prefix = attr + f'[{i}]'
-                if attr == 'type':
-                    # Ignore this obj
-                    continue
 
-        # Walk each tree and output the "flat" STIX path to each SCO property
-        roots = set([node.root for node in nodes.values()])
-        result = json_normalize({key: obj[key] for key in obj.keys() if key != 'objects'})
+        # Walk each tree and map the "flat" STIX path of each SCO property to where its value is
+        template = []
+        roots = list(dict.fromkeys(node.root for node in nodes.values()))
         for root in roots:
-            root_type = root.fields['type'] + ':'
-            for node in PreOrderIter(root):
-                tmp = node
-                pre = ''
-                while tmp.parent:
-                    if hasattr(tmp, 'prefix'):
-                        pre = tmp.prefix + '.' + pre
-                    tmp = tmp.parent
-                prefix = root.fields['type'] + ':' + pre
+            stack = [(root, root.fields['type'] + ':')]
+            while stack:
+                node, prefix = stack.pop()
                 for attr, val in node.fields.items():
-                    if not (attr.endswith('_ref') or attr.endswith('_refs')):
-                        if isinstance(val, list):
-                            for i, v in enumerate(val):
-                                result[prefix + attr + f'[{i}]'] = v
-                        elif isinstance(val, dict):
-                            # normalize dict and "merge" into result
-                            result.update({f'{prefix}{attr}.{k}': v for k, v in json_normalize(val).items()})
-                        else:
-                            result[prefix + attr] = val
-        return [result]
-
-
-    def search_df(self, query: str, config_names: list):
-        # TODO: parallelize this method.
-        dfs = []
-        for cfn in config_names:
-            stix_bundle = self.stix_shiter_execute(cfn, query)
+                    if attr.endswith('_ref') or attr.endswith('_refs'):
+                        continue
+                    if isinstance(val, list):
+                        template.extend((prefix + attr + f'[{i}]', node.key, attr, i) for i in range(len(val)))
+                    elif not isinstance(val, dict):
+                        # dict properties are left out, as the DataFrame.update() merge of flatten_sco did
+                        template.append((prefix + attr, node.key, attr, None))
+                # pre-order: children are visited in the order they were referenced
+                stack.extend((child, f'{prefix}{child.prefix}.') for child in reversed(node.children))
+        return template
+
+
+    def search_df(self, query: str, config_names: list, timeout: float = None, raise_errors: bool = False,
+                  columns: list = None, groupby: list = None, agg: dict = None):
+        # Data sources are searched concurrently, at most max_workers at a time.
+        # A data source which fails or is not done within timeout seconds of starting is left out of the result,
+        # and reported in self.last_errors; raise_errors raises the first failure instead.
+        # columns limits the flattened columns to those, and groupby/agg (see AQL.push_down) aggregates
+        # each data source as its results are flattened, so only the columns they use are materialized.
+        if columns and (groupby or agg):
+            raise Exception('columns selects columns, it cannot be combined with groupby and agg')
+        if groupby or agg:
+            used = list(groupby or []) + [column for column, _ in named_aggs(agg).values() if column != '*']
+            columns = list(dict.fromkeys(used))
+
+        def execute(cfn, source_stats):
+            started[cfn] = time.time()
+            stix_bundle = self.stix_shiter_execute(cfn, query, source_stats)
             if not stix_bundle:
-                continue
-            df_ = self.stix2dataframe(stix_bundle)
-            if df_.empty:
-                continue
-            df_['data_source'] = cfn
-            dfs.append(df_)
+                return None
+            df_ = self.stix2dataframe(stix_bundle, source_stats, columns)
+            if groupby or agg:
+                with source_stats.timer('aggregate'):
+                    df_ = aggregate(df_, groupby, agg)
+            return df_
+
+        def result(cfn, future):
+            # The timeout of a data source runs from when a worker starts it, not from when it was queued
+            if timeout is not None:
+                while cfn not in started and not future.done():
+                    # Data sources which timed out but still run hold their workers, when they hold all of them
+                    # the queued data sources cannot start
+                    if sum(not f.done() for f in timed_out) >= workers:
+                        raise TimeoutError()
+                    wait([future], timeout=0.05)
+                wait([future], timeout=max(0, started.get(cfn, 0) + timeout - time.time()))
+                if not future.done():
+                    raise TimeoutError()
+            return future.result()
+
+        self.last_errors = {}
+        # Each data source has its own stats, merged once it finished: the phases are summed over the data sources,
+        # and data sources which timed out cannot change the stats after they are published
+        stats = Stats('search', query=query, config_names=list(config_names))
+        started, timed_out = {}, []
+        workers = max(1, min(self.max_workers, len(config_names)))
+        executor = ThreadPoolExecutor(max_workers=workers)
+        futures = []
+        for cfn in config_names:
+            source_stats = Stats('search', query=query, config_name=cfn)
+            futures.append((cfn, source_stats, executor.submit(execute, cfn, source_stats)))
+        dfs = []
+        try:
+            # Merge in the order of config_names
+            for cfn, source_stats, future in futures:
+                try:
+                    df_ = result(cfn, future)
+                except Exception as e:
+                    if not future.done():
+                        # The wait timed out, unlike a TimeoutError raised by the connector of a finished data source
+                        logging.error('Data source {} did not finish within {} seconds'.format(cfn, timeout))
+                        self.last_errors[cfn] = e
+                        timed_out.append(future)
+                        stats.count('timeouts')
+                        continue
+                    logging.error('Data source {} failed: {}'.format(cfn, e))
+                    stats.merge(source_stats)
+                    stats.count('errors')
+                    if raise_errors:
+                        raise
+                    self.last_errors[cfn] = e
+                    continue
+                stats.merge(source_stats)
+                if df_ is None or df_.empty:
+                    continue
+                df_['data_source'] = cfn
+                dfs.append(df_)
+        finally:
+            # Do not wait for data sources which timed out
+            executor.shutdown(wait=False, cancel_futures=True)
+            self._finish_stats(stats)
         return pd.concat(dfs) if dfs else pd.DataFrame()
 
 
+    def search_df_iter(self, query: str, config_names: list, page_size: int = None, stats: Stats = None,
+                       columns: list = None):
+        # Yields a DataFrame chunk per page of results, data source by data source,
+        # so memory stays bounded however many records the data sources return.
+        # columns limits the flattened columns to those, like in search_df.
+        # Without stats, the stats of the search are finished and published when the iteration ends
+        own_stats = stats is None
+        stats = stats or Stats('search', query=query, config_names=list(config_names))
+        try:
+            for cfn in config_names:
+                for stix_bundle in self.stix_shiter_execute_iter(cfn, query, page_size, stats):
+                    if not stix_bundle:
+                        continue
+                    df_ = self.stix2dataframe(stix_bundle, stats, columns)
+                    if df_.empty:
+                        continue
+                    df_['data_source'] = cfn
+                    yield df_
+        finally:
+            if own_stats:
+                self._finish_stats(stats)
+
+
+    def search_to_dataset(self, path: str, query: str, config_names: list, page_size: int = None,
+                          slice_freq: str = 'h', format: str = 'parquet'):
+        # Writes the results to a dataset on disk page by page, partitioned by data_source and by time_slice,
+        # the start of the slice_freq period (a pandas frequency) of first_observed, and returns it unread.
+        # Data sources run concurrently; failed ones are reported in self.last_errors and their partitions removed
+        writer = DatasetWriter(path, format=format)
+
+        def write(cfn):
+            writer.remove(cfn)
+            for df_ in self.search_df_iter(query, [cfn], page_size, stats):
+                if 'first_observed' in df_:
+                    observed = pd.to_datetime(df_['first_observed'], errors='coerce', utc=True)
+                    df_['time_slice'] = observed.dt.floor(slice_freq).dt.strftime('%Y%m%dT%H%M%S').fillna('all')
+                else:
+                    df_['time_slice'] = 'all'
+                with stats.timer('write'):
+                    writer.write(df_)
+
+        self.last_errors = {}
+        stats = Stats('search', query=query, config_names=list(config_names), path=path)
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(config_names)))) as executor:
+            futures = [(cfn, executor.submit(write, cfn)) for cfn in config_names]
+            for cfn, future in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    logging.error('Data source {} failed: {}'.format(cfn, e))
+                    self.last_errors[cfn] = e
+                    stats.count('errors')
+                    writer.remove(cfn)
+        self._finish_stats(stats)
+        return writer.dataset()
+
+
 if __name__ == '__main__':
     qradar_config = {
         'connection': {
@@ -0,0 +1,78 @@
+#
+# Copyright (C) 2020 IBM. All Rights Reserved.
+#
+# See LICENSE file in the root directory
+# of this source tree for licensing information.
+#
+
+import pytest
+
+from pyclient.qradar import AQL
+
+
+def test_projection_keeps_columns_of_having_and_order_by():
+    aql = '''select sourceip as src, count(*) as hits, sum(eventcount) as total
+from events
+group by src
+having hits > 10
+order by total desc'''
+    query = AQL.push_down(aql, columns=['src'])
+    assert query == '''select sourceip as src,
+count(*) as hits,
+sum(eventcount) as total
+from events
+group by src
+having hits > 10
+order by total desc'''
+
+
+def test_projection_of_unnamed_expression():
+    query = AQL.push_down('select username, sourceip from events', columns=['username', 'str(sourceip)'])
+    assert query == 'select username,\nstr(sourceip) from events'
+
+
+def test_groupby_goes_before_having_and_order_by():
+    aql = "select username as user, eventcount from events where category = 'having order by' order by user"
+    query = AQL.push_down(aql, groupby=['user'], agg={'eventcount': 'sum'})
+    assert query == ("select username as user,\nSUM(eventcount) as eventcount_sum from events "
+                     "where category = 'having order by'\ngroup by user order by user")
+
+
+def test_groupby_goes_before_time_clause():
+    aql = 'select username as user, eventcount from events where qid = 5 last 2 hours'
+    query = AQL.push_down(aql, groupby=['user'], agg={'count': ('*', 'count')})
+    assert query == 'select username as user,\nCOUNT(*) as count from events where qid = 5\ngroup by user last 2 hours'
+
+    aql = "select username from events start '2020-01-01 00:00' stop '2020-01-02 00:00'"
+    query = AQL.push_down(aql, groupby=['username'])
+    assert query == "select username from events\ngroup by username start '2020-01-01 00:00' stop '2020-01-02 00:00'"
+
+
+def test_groupby_of_grouped_search_fails():
+    with pytest.raises(Exception, match='already grouped'):
+        AQL.push_down(AQL.proxy_model, groupby=['user'], agg={'general_count_rows': 'sum'})
+
+
+def test_group_by_in_a_string_is_not_a_group_by():
+    aql = "select username, eventcount from events where payload = ' group by x '"
+    query = AQL.push_down(aql, groupby=['username'], agg={'eventcount': 'max'})
+    assert query.endswith("where payload = ' group by x '\ngroup by username")
+
+
+def test_columns_with_groupby_fails():
+    with pytest.raises(Exception, match='columns selects columns'):
+        AQL.push_down('select username from events', columns=['username'], groupby=['username'])
+
+
+def test_groupby_with_order_by_of_dropped_alias_fails():
+    aql = 'select sourceip as src, eventcount as ec from events order by ec desc'
+    with pytest.raises(Exception, match='refers to ec'):
+        AQL.push_down(aql, groupby=['src'], agg={'ec': 'sum'})
+
+    query = AQL.push_down(aql, groupby=['src'], agg={'ec': ('ec', 'sum')})
+    assert query == 'select sourceip as src,\nSUM(eventcount) as ec from events\ngroup by src order by ec desc'
+
+
+def test_agg_of_grouped_search_without_its_groups_fails():
+    with pytest.raises(Exception, match='refers to user, timeslice'):
+        AQL.push_down(AQL.proxy_model, agg={'general_count_rows': 'sum'})
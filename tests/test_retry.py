@@ -0,0 +1,89 @@
+#
+# Copyright (C) 2020 IBM. All Rights Reserved.
+#
+# See LICENSE file in the root directory
+# of this source tree for licensing information.
+#
+
+from email.utils import formatdate
+import time
+
+import pytest
+
+from pyclient.retry import RateLimiter, RetryPolicy
+
+
+@pytest.mark.parametrize('method, status, error, retryable', [
+    ('GET', 503, False, True),
+    ('get', 500, False, True),
+    ('DELETE', 504, False, True),
+    ('GET', 404, False, False),
+    ('POST', 500, False, False),
+    ('POST', 429, False, True),
+    ('POST', 503, False, True),
+    ('GET', None, True, True),
+    ('POST', None, True, False),
+])
+def test_retryable(method, status, error, retryable):
+    assert RetryPolicy().retryable(method, status, error) is retryable
+
+
+def test_retryable_statuses_and_methods_can_be_changed():
+    policy = RetryPolicy(statuses=[500], methods=['POST'])
+    assert policy.retryable('POST', 500)
+    assert not policy.retryable('GET', 500)
+    assert not policy.retryable('POST', 429)
+
+
+def test_next_wait_grows_with_full_jitter():
+    policy = RetryPolicy(retries=5, backoff=0.5, factor=2.0, max_backoff=3.0)
+    for attempt in range(5):
+        for _ in range(50):
+            wait = policy.next_wait('GET', attempt, 0, status=503)
+            assert 0 <= wait <= min(3.0, 0.5 * 2 ** attempt)
+
+
+def test_next_wait_gives_up():
+    policy = RetryPolicy(retries=2, max_elapsed=10.0)
+    assert policy.next_wait('GET', 2, 0, status=503) is None
+    assert policy.next_wait('GET', 0, 0, status=404) is None
+    assert policy.next_wait('POST', 0, 0, error=True) is None
+    # a wait ending after max_elapsed is not made
+    assert policy.next_wait('GET', 0, 0, status=429, retry_after=20) is None
+    assert policy.next_wait('GET', 0, 10.5, status=503) is None
+
+
+def test_next_wait_waits_retry_after_at_least():
+    policy = RetryPolicy(backoff=0.5)
+    wait = policy.next_wait('POST', 0, 0, status=429, retry_after=4)
+    assert 4 <= wait <= 4.5
+
+
+def test_copy_keeps_settings_given_as_none():
+    policy = RetryPolicy(retries=3, backoff=0.5).copy(retries=None, backoff=2)
+    assert (policy.retries, policy.backoff) == (3, 2)
+
+
+def test_parse_retry_after():
+    assert RetryPolicy.parse_retry_after('3') == 3.0
+    assert RetryPolicy.parse_retry_after('-1') == 0.0
+    assert RetryPolicy.parse_retry_after(None) is None
+    assert RetryPolicy.parse_retry_after('soon') is None
+    assert 25 < RetryPolicy.parse_retry_after(formatdate(time.time() + 30, usegmt=True)) <= 30
+
+
+def test_after_failure_pauses_the_limiter():
+    limiter = RateLimiter(jitter=0)
+    wait = RetryPolicy().after_failure('GET', 0, time.time(), status=503, headers={'Retry-After': '2'},
+                                       url='https://console/api/x', limiter=limiter)
+    assert wait >= 2
+    assert 1.5 < limiter.reserve('https://console/api/y') <= 2
+    assert limiter.reserve('https://other/api/x') == 0
+
+
+def test_rate_limiter_queues_requests_past_the_burst():
+    limiter = RateLimiter(rate=10, burst=2)
+    waits = [limiter.reserve('https://console/api') for _ in range(4)]
+    assert waits[:2] == [0, 0]
+    assert waits[2] == pytest.approx(0.1, abs=0.02)
+    assert waits[3] == pytest.approx(0.2, abs=0.02)
@@ -0,0 +1,113 @@
+#
+# Copyright (C) 2020 IBM. All Rights Reserved.
+#
+# See LICENSE file in the root directory
+# of this source tree for licensing information.
+#
+
+import os
+
+import pandas as pd
+import pytest
+
+pytest.importorskip('stix_shifter')
+
+from benchmarks.synthetic import stix_bundle  # noqa: E402
+from pyclient.stix_shifter_dataframe import StixShifterDataFrame  # noqa: E402
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+
+# ref, refs, two refs to the same SCO, list and dict properties, and a nested envelope
+OBSERVED = {
+    'type': 'observed-data', 'id': 'observed-data--00000000-0000-4000-8000-000000000001',
+    'created_by_ref': 'identity--3532c56d-ea72-48be-a2ad-1a53f4c9c6d3',
+    'first_observed': '2020-06-01T00:00:00.000Z', 'last_observed': '2020-06-01T00:01:00.000Z',
+    'number_observed': 2, 'x_source': {'name': 'qradar', 'log': {'id': 7}},
+    'objects': {
+        '0': {'type': 'ipv4-addr', 'value': '10.0.0.1', 'resolves_to_refs': ['2']},
+        '1': {'type': 'ipv4-addr', 'value': '192.168.0.1'},
+        '2': {'type': 'mac-addr', 'value': '00:50:56:00:00:01'},
+        '3': {'type': 'network-traffic', 'src_ref': '0', 'dst_ref': '1', 'src_port': 5000, 'dst_port': 443,
+              'protocols': ['tcp', 'ssl']},
+        '4': {'type': 'user-account', 'user_id': 'alice'},
+        '5': {'type': 'file', 'name': 'a.exe', 'hashes': {'SHA-256': 'ab' * 32}},
+        '6': {'type': 'process', 'pid': 10, 'binary_ref': '5', 'creator_user_ref': '4'},
+        '7': {'type': 'x-oca-event', 'action': 'login', 'user_ref': '4'},
+    },
+}
+
+# the row flatten_sco() returned for OBSERVED before flattening was compiled into templates
+EXPECTED = {
+    'type': 'observed-data',
+    'id': 'observed-data--00000000-0000-4000-8000-000000000001',
+    'created_by_ref': 'identity--3532c56d-ea72-48be-a2ad-1a53f4c9c6d3',
+    'first_observed': '2020-06-01T00:00:00.000Z',
+    'last_observed': '2020-06-01T00:01:00.000Z',
+    'number_observed': 2,
+    'x_source.name': 'qradar',
+    'x_source.log.id': 7,
+    'x-oca-event:type': 'x-oca-event',
+    'x-oca-event:action': 'login',
+    'x-oca-event:user_ref.type': 'user-account',
+    'x-oca-event:user_ref.user_id': 'alice',
+    'network-traffic:type': 'network-traffic',
+    'network-traffic:src_port': 5000,
+    'network-traffic:dst_port': 443,
+    'network-traffic:protocols[0]': 'tcp',
+    'network-traffic:protocols[1]': 'ssl',
+    'network-traffic:src_ref.type': 'ipv4-addr',
+    'network-traffic:src_ref.value': '10.0.0.1',
+    'network-traffic:src_ref.resolves_to_refs[0].type': 'mac-addr',
+    'network-traffic:src_ref.resolves_to_refs[0].value': '00:50:56:00:00:01',
+    'network-traffic:dst_ref.type': 'ipv4-addr',
+    'network-traffic:dst_ref.value': '192.168.0.1',
+    'process:type': 'process',
+    'process:pid': 10,
+    'process:binary_ref.type': 'file',
+    'process:binary_ref.name': 'a.exe',
+    'process:creator_user_ref.type': 'user-account',
+    'process:creator_user_ref.user_id': 'alice',
+}
+
+
+def test_flatten_observed_data():
+    assert StixShifterDataFrame().flatten_observed_data(OBSERVED) == EXPECTED
+
+
+def test_flatten_sco_matches_expected_frame():
+    df = StixShifterDataFrame().flatten_sco(OBSERVED)[0]
+    pd.testing.assert_frame_equal(df, pd.DataFrame([EXPECTED]), check_like=True)
+
+
+def test_stix2dataframe_of_synthetic_bundle():
+    # frozen from the flatten_sco() of each observed-data object of the bundle before templates
+    expected = pd.read_json(os.path.join(DATA, 'stix_bundle_6.json'), orient='split', dtype=False)
+    df = StixShifterDataFrame().stix2dataframe(stix_bundle(6))
+    pd.testing.assert_frame_equal(df, expected, check_like=True)
+
+
+def test_stix2dataframe_columns():
+    columns = ['network-traffic:dst_port', 'number_observed', 'missing']
+    df = StixShifterDataFrame().stix2dataframe(stix_bundle(6), columns=columns)
+    expected = pd.read_json(os.path.join(DATA, 'stix_bundle_6.json'), orient='split', dtype=False)
+    assert list(df.columns) == columns
+    assert df['network-traffic:dst_port'].tolist() == expected['network-traffic:dst_port'].tolist()
+    assert df['missing'].isna().all()
+
+
+def test_template_cache_hits():
+    flattener = StixShifterDataFrame(template_cache_size=1)
+    flattener.flatten_observed_data(OBSERVED)
+    flattener.flatten_observed_data(dict(OBSERVED, id='observed-data--2'))
+    assert (flattener.template_hits, flattener.template_misses) == (1, 1)
+
+    # another graph shape is a miss, and evicts the only template
+    other = dict(OBSERVED, objects={'0': {'type': 'ipv4-addr', 'value': '10.0.0.2'}})
+    flattener.flatten_observed_data(other)
+    flattener.flatten_observed_data(OBSERVED)
+    info = flattener.template_cache_info()
+    assert (info['hits'], info['misses'], info['size']) == (1, 3, 1)
+
+    # the same shape flattened to other columns has its own template
+    flattener.flatten_observed_data(OBSERVED, frozenset(['process:pid']))
+    assert flattener.template_misses == 4